@@ -1,16 +1,28 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 from managers.message import MessageManager
 from filter import MentalHealthFilter
-from config import Config
+from config import Config, get_llm, invoke_with_retry
+from data import FusedTurnResult, TurnMetadata, MessagePair, UserMessage, LLMMessage
 from managers.firebase_manager import FirebaseManager
 from managers.summary import SummaryManager
 from managers.events import EventManager
 from managers.crisis import CrisisManager
 from managers.helper import HelperManager
 from firebase_writer import FirebaseWriter
+from managers.response_cache import ResponseCache
+from aiolimiter import AsyncLimiter
 import asyncio
 import logging
+import threading
+from datetime import date
+
+
+# One persistent event loop shared by every request. asyncio.run per call
+# would create and destroy a loop each time, killing the FirebaseWriter
+# worker task (started under the old loop) and preventing writes from
+# batching across requests.
+_LOOP = asyncio.new_event_loop()
+threading.Thread(target=_LOOP.run_forever, daemon=True, name="chatbot-loop").start()
 
 
 class MentalHealthChatbot:
@@ -19,15 +31,13 @@ class MentalHealthChatbot:
     def __init__(self):
         logging.info("Initializing MentalHealthChatbot...")
         self.firebase_manager = FirebaseManager()
-        self.writer = FirebaseWriter()
+        self.writer = FirebaseWriter(loop=_LOOP)
         self.config = Config()
 
-        self.llm = ChatGoogleGenerativeAI(
-            model=self.config.model_name,
-            google_api_key=self.config.gemini_api_key,
-            temperature=self.config.temperature,
-            max_tokens=self.config.max_tokens
-        )
+        # Bounded per request so a hung Gemini call can't pin a worker; the
+        # fused/meta structured clients below inherit the timeout.
+        self.llm = get_llm(self.config.temperature, max_tokens=self.config.max_tokens,
+                           request_timeout=30.0)
 
         self.message_manager = MessageManager(self.firebase_manager)
         self.health_filter = MentalHealthFilter(self.config)
@@ -109,134 +119,317 @@ class MentalHealthChatbot:
 
         Remember: You can be caring and supportive without being aggressive. Save the intense, protective energy for when someone actually needs saving."""
 
+        self.fused_instructions = """
+        📋 STRUCTURED TURN ANALYSIS - VERY IMPORTANT:
+        Along with your reply, analyze the user's CURRENT message and fill every field:
+        - emotion: single word for the primary emotion (happy, sad, anxious, angry, neutral, etc.)
+        - urgency: 1-5 (1=casual, 2=mild concern, 3=moderate distress, 4=high distress, 5=CRISIS with suicidal thoughts/immediate danger). Most messages are 1-3.
+        - is_mental_health: true if the message discusses emotions, stress, relationships, personal struggles or psychological well-being, or follows up on earlier mental-health talk. false for off-topic questions (homework answers, coding help, trivia...).
+        - event: if the message mentions an important upcoming/recent event (exam, interview, appointment, deadline, party...) with clear timing, set has_event=true, event_type, event_date as YYYY-MM-DD and confidence 0.0-1.0. Otherwise has_event=false.
+        - reply: your actual chat reply as Sorea, following all the personality rules above. If is_mental_health is false, reply can be empty."""
 
+        self.fused_llm = self.llm.with_structured_output(FusedTurnResult)
+        self.meta_llm = self.llm.with_structured_output(TurnMetadata)
 
-    # ---------------------------------------------------------------------
-    async def process_conversation_async(self, email: str, message: str) -> str:
-        try:
-            # Fetch in parallel
-            user_profile, emotion_urgency, recent_messages = await asyncio.gather(
-                asyncio.to_thread(self.firebase_manager.get_user_profile, email),
-                asyncio.to_thread(self.helper_manager.detect_emotion, message),
-                asyncio.to_thread(self.message_manager.get_conversation, email, self.firebase_manager, None, 20)
-            )
+        # Byte-identical static prefix sent first on every call so Gemini's
+        # implicit prefix cache can hit; dynamic state goes in a second,
+        # small SystemMessage and must never be interpolated into this one.
+        self.static_system_prompt = f"{self.system_prompt}\n\n{self.fused_instructions}"
 
-            # Last 2–3 messages
-            if recent_messages:
-                last_messages = [msg.user_message.content for msg in recent_messages[-3:]]
-            else:
-                last_messages = [message]
+        # Cooperative throttling so Gemini calls queue instead of hitting 429s
+        self._sem = asyncio.Semaphore(self.config.max_concurrency)
+        self._rpm = AsyncLimiter(self.config.rpm, 60)
+        self._tpm = AsyncLimiter(self.config.tpm, 60)
+
+        # Recent-conversation cache: email -> pairs. Saves one Firestore
+        # query per turn for chatty users; new pairs are appended locally
+        # after each reply instead of re-reading. ResponseCache bounds it —
+        # a plain dict would keep one entry per user ever seen for the life
+        # of the worker.
+        self._conv_cache = ResponseCache(maxsize=1000, ttl=60.0)
 
-            # Extract emotion/urgency
-            emotion, urgency_level = emotion_urgency
-            user_name = user_profile.name
 
 
-            if not message.startswith("[TEST]"):
-                topic_filter = await asyncio.to_thread(self.health_filter.filter, last_messages)
+    # ---------------------------------------------------------------------
+    async def process_conversation_async(self, email: str, message: str) -> str:
+        # Test traffic gets a canned reply before any Firestore or LLM I/O
+        if message.startswith("[TEST]"):
+            return "[TEST CHAT SUCCESS]"
+
+        try:
+            user_profile, recent_messages = await self._load_context(email)
+            history, summary_line = await self._trim_history(email, recent_messages)
+
+            # One fused LLM call: emotion + urgency + topic filter + event + reply
+            result = await self._fused_turn(email, message, history, user_profile.name, summary_line)
+            emotion = result.emotion
+            urgency_level = result.urgency
 
             # Ignore non-mental-health queries
-            if not topic_filter.is_mental_health_related:
+            if not result.is_mental_health:
                 redirect = "Sorry but i can not answer to that question!!!."
                 asyncio.create_task(
                     self.writer.submit(self.message_manager.add_chat_pair,
                                        email, message, redirect, emotion, urgency_level)
                 )
+                self._append_cached_pair(email, message, redirect, emotion, urgency_level)
                 return redirect
 
-            # Extract events (background)
-            event_future = asyncio.create_task(
-                asyncio.to_thread(self.event_manager._extract_events_with_llm, message, email)
-            )
-
-            # Crisis handling
+            # Crisis handling (second LLM call only when truly needed)
             if urgency_level >= 5:
-                crisis = self.crisis_manager.handle_crisis_situation(email, message, self.firebase_manager)
+                crisis = await self.crisis_manager.handle_crisis_situation_async(email, message, self.firebase_manager)
                 asyncio.create_task(
                     self.writer.submit(self.message_manager.add_chat_pair,
                                        email, message, crisis.content, emotion, urgency_level)
                 )
+                # The next turn must see the crisis exchange in its history
+                self._append_cached_pair(email, message, crisis.content, emotion, urgency_level)
                 return crisis.content
 
-            # Add event if exists
-            event = await event_future
+            # Add event if the fused call found one
+            event = None
+            if result.event and result.event.has_event and result.event.confidence >= 0.7:
+                event = self.event_manager.build_event(
+                    email, message, result.event.event_type, result.event.event_date
+                )
+
+            bot_message = result.reply
+
+            # Persist the whole turn as one writer submission (non-blocking)
+            ops = [
+                (self.message_manager.add_chat_pair,
+                 (email, message, bot_message, emotion, urgency_level), {}),
+                (self.message_manager.add_suggestions,
+                 (self.helper_manager, emotion, urgency_level, email,
+                  self.firebase_manager, self.message_manager, message), {})
+            ]
             if event:
-                asyncio.create_task(self.writer.submit(self.event_manager.add_event, email, event))
-
-            # Normal response
-            return await self._generate_response_async(
-                email=email,
-                message=message,
-                user_name=user_name,
-                emotion=emotion,
-                urgency_level=urgency_level,
-                recent_messages=recent_messages
-            ) # type: ignore
+                ops.append((self.event_manager.add_event, (email, event), {}))
+            asyncio.create_task(self.writer.submit_many(ops))
+
+            self._append_cached_pair(email, message, bot_message, emotion, urgency_level)
+
+            return bot_message
 
         except Exception as e:
             logging.error(f"Error async conversation: {e}")
-            return self.process_conversation_sync(email, message)
+            self._conv_cache.discard("conv", email)
+            # The sync fallback is all blocking I/O; running it inline would
+            # stall the shared loop (and every other conversation) exactly
+            # when Gemini is already erroring. It never touches the loop
+            # itself — submit_sync only — so a worker thread is safe.
+            return await asyncio.to_thread(self.process_conversation_sync, email, message)
 
 
     # ---------------------------------------------------------------------
-    async def _generate_response_async(self, email, message, user_name, emotion, urgency_level, recent_messages):
-        try:
-            enhanced_prompt = f"""
-{self.system_prompt}
+    def _append_cached_pair(self, email, user_message, bot_message, emotion, urgency_level):
+        """Append the just-generated pair to the cached conversation instead of re-reading."""
+        pairs = self._conv_cache.get("conv", email)
+        if pairs is None:
+            return
+
+        pair = MessagePair(
+            user_message=UserMessage(content=user_message, emotion_detected=emotion, urgency_level=urgency_level),
+            llm_message=LLMMessage(content=bot_message)
+        )
+        # Re-putting refreshes the TTL, which is sound here: the appended
+        # pair mirrors the write we just queued, so the entry stays accurate.
+        self._conv_cache.put("conv", email, (pairs + [pair])[-20:])
 
-CONVERSATION CONTEXT:
-{recent_messages}
 
-CURRENT USER STATE:
-- Emotion: {emotion}
-- Urgency: {urgency_level}/5
-- Name: {user_name}
-"""
+    # ---------------------------------------------------------------------
+    async def _load_context(self, email: str):
+        """Load (user_profile, recent_messages), using the TTL cache when fresh."""
+        cached = self._conv_cache.get("conv", email)
+        if cached is not None:
+            user_profile = await self.firebase_manager.get_user_profile_async(email)
+            return user_profile, cached
 
-            messages = [SystemMessage(content=enhanced_prompt)]
+        # Profile + today's chat in one concurrent async read
+        user_profile, recent_messages = await self.firebase_manager.get_user_profile_and_conversation(email, 20)
 
-            # Chat history
-            if recent_messages:
-                for msg_pair in recent_messages:
-                    messages.append(HumanMessage(content=msg_pair.user_message.content))
-                    messages.append(AIMessage(content=msg_pair.llm_message.content))
+        # No conversation today — fall back to the last conversation day
+        if not recent_messages:
+            recent_messages = await self.firebase_manager.get_last_conversation_async(email, 20)
 
-            # Add new message okay
-            messages.append(HumanMessage(content=message))
+        self._conv_cache.put("conv", email, recent_messages)
+        return user_profile, recent_messages
 
-            # LLM CALL
-            response = await asyncio.to_thread(self.llm.invoke, messages)
-            bot_message = response.content
 
-            # Persist interaction (non-blocking for caller)
-            asyncio.create_task(self.writer.submit(
-                self.message_manager.add_chat_pair,
-                email, message, bot_message, emotion, urgency_level
-            ))
+    # ---------------------------------------------------------------------
+    async def _trim_history(self, email: str, recent_messages):
+        """Keep only the last K pairs verbatim; stand in a summary for older turns."""
+        summary_line = None
+        k = self.config.history_pairs_verbatim
+        if len(recent_messages) > k:
+            summary = await asyncio.to_thread(
+                self.summary_manager.get_daily_summary, email, date.today().isoformat()
+            )
+            if summary:
+                summary_line = summary.get('summary_text')
+            recent_messages = recent_messages[-k:]
+        return recent_messages, summary_line
 
-            asyncio.create_task(self.writer.submit(
-                self.message_manager.add_suggestions,
-                self.helper_manager,
-                emotion,
-                urgency_level,
-                email,
-                self.firebase_manager,
-                self.message_manager,
-                message
-                
-            ))
-            
-            return bot_message
 
-        except Exception as e:
-            logging.error(f"Error generating response: {e}")
-            raise
+    # ---------------------------------------------------------------------
+    async def process_conversation_stream(self, email: str, message: str):
+        """Stream the reply chunk-by-chunk instead of buffering it to one string.
+
+        Classification still happens first (one small structured call) so the
+        topic filter and crisis path keep their behavior, then the reply is
+        streamed from Gemini as it is generated. The full reply is persisted
+        only after the stream closes.
+        """
+        if message.startswith("[TEST]"):
+            yield "[TEST CHAT SUCCESS]"
+            return
+
+        user_profile, recent_messages = await self._load_context(email)
+        history, summary_line = await self._trim_history(email, recent_messages)
+
+        meta = await self._classify_turn(message, history, user_profile.name, summary_line)
+        emotion = meta.emotion
+        urgency_level = meta.urgency
+
+        if not meta.is_mental_health:
+            redirect = "Sorry but i can not answer to that question!!!."
+            asyncio.create_task(
+                self.writer.submit(self.message_manager.add_chat_pair,
+                                   email, message, redirect, emotion, urgency_level)
+            )
+            self._append_cached_pair(email, message, redirect, emotion, urgency_level)
+            yield redirect
+            return
+
+        if urgency_level >= 5:
+            crisis = await self.crisis_manager.handle_crisis_situation_async(email, message, self.firebase_manager)
+            asyncio.create_task(
+                self.writer.submit(self.message_manager.add_chat_pair,
+                                   email, message, crisis.content, emotion, urgency_level)
+            )
+            # The next turn must see the crisis exchange in its history
+            self._append_cached_pair(email, message, crisis.content, emotion, urgency_level)
+            yield crisis.content
+            return
+
+        event = None
+        if meta.event and meta.event.has_event and meta.event.confidence >= 0.7:
+            event = self.event_manager.build_event(email, message, meta.event.event_type, meta.event.event_date)
+
+        user_state = f"CURRENT USER STATE:\n- Emotion: {emotion}\n- Urgency: {urgency_level}/5\n- Name: {user_profile.name}"
+        if summary_line:
+            user_state += f"\n\nSUMMARY OF EARLIER CONVERSATION:\n{summary_line}"
+
+        messages = [
+            SystemMessage(content=self.system_prompt),
+            SystemMessage(content=user_state)
+        ]
+        for msg_pair in history:
+            messages.append(HumanMessage(content=msg_pair.user_message.content))
+            messages.append(AIMessage(content=msg_pair.llm_message.content))
+        messages.append(HumanMessage(content=message))
+
+        chunks = []
+        async for chunk in self._throttled_stream(self.llm, messages):
+            text = chunk.content
+            if text:
+                chunks.append(text)
+                yield text
+
+        bot_message = "".join(chunks)
+
+        # Persist only once the full reply is known, as one writer submission
+        ops = [
+            (self.message_manager.add_chat_pair,
+             (email, message, bot_message, emotion, urgency_level), {}),
+            (self.message_manager.add_suggestions,
+             (self.helper_manager, emotion, urgency_level, email,
+              self.firebase_manager, self.message_manager, message), {})
+        ]
+        if event:
+            ops.append((self.event_manager.add_event, (email, event), {}))
+        asyncio.create_task(self.writer.submit_many(ops))
+
+        self._append_cached_pair(email, message, bot_message, emotion, urgency_level)
+
+
+    # ---------------------------------------------------------------------
+    async def _classify_turn(self, message, recent_messages, user_name, summary_line=None) -> TurnMetadata:
+        """Metadata-only structured call used by the streaming path."""
+        user_state = f"CURRENT USER STATE:\n- Name: {user_name}"
+        if summary_line:
+            user_state += f"\n\nSUMMARY OF EARLIER CONVERSATION:\n{summary_line}"
+
+        messages = [
+            SystemMessage(content=self.static_system_prompt),
+            SystemMessage(content=user_state)
+        ]
+        for msg_pair in recent_messages:
+            messages.append(HumanMessage(content=msg_pair.user_message.content))
+            messages.append(AIMessage(content=msg_pair.llm_message.content))
+        messages.append(HumanMessage(content=message))
+
+        return await self._throttled_invoke(self.meta_llm, messages)
+
+
+    # ---------------------------------------------------------------------
+    async def _fused_turn(self, email, message, recent_messages, user_name, summary_line=None) -> FusedTurnResult:
+        """Run emotion detection, topic filter, event extraction and the reply in ONE Gemini call."""
+        user_state = f"CURRENT USER STATE:\n- Name: {user_name}"
+        if summary_line:
+            user_state += f"\n\nSUMMARY OF EARLIER CONVERSATION:\n{summary_line}"
+
+        messages = [
+            SystemMessage(content=self.static_system_prompt),
+            SystemMessage(content=user_state)
+        ]
+
+        # Chat history
+        if recent_messages:
+            for msg_pair in recent_messages:
+                messages.append(HumanMessage(content=msg_pair.user_message.content))
+                messages.append(AIMessage(content=msg_pair.llm_message.content))
+
+        # Add new message okay
+        messages.append(HumanMessage(content=message))
+
+        return await self._throttled_invoke(self.fused_llm, messages)
+
+
+    # ---------------------------------------------------------------------
+    async def _throttled_invoke(self, llm, messages):
+        """Invoke an LLM under the RPM/TPM limiters and the concurrency semaphore."""
+        estimated_tokens = max(1, sum(len(str(m.content).split()) for m in messages))
+        async with self._sem:
+            async with self._rpm:
+                await self._tpm.acquire(min(estimated_tokens, self.config.tpm))
+                return await asyncio.to_thread(invoke_with_retry, llm, messages)
+
+
+    # ---------------------------------------------------------------------
+    async def _throttled_stream(self, llm, messages):
+        """Stream an LLM reply under the same limiters as _throttled_invoke.
+
+        The semaphore is held for the whole stream — a half-delivered reply
+        still occupies a Gemini connection.
+        """
+        estimated_tokens = max(1, sum(len(str(m.content).split()) for m in messages))
+        async with self._sem:
+            async with self._rpm:
+                await self._tpm.acquire(min(estimated_tokens, self.config.tpm))
+                async for chunk in llm.astream(messages):
+                    yield chunk
 
 
     # ---------------------------------------------------------------------
     def process_conversation(self, email: str, message: str) -> str:
         """Required by API + test"""
-        return asyncio.run(self.process_conversation_async(email, message))
+        future = asyncio.run_coroutine_threadsafe(
+            self.process_conversation_async(email, message), _LOOP
+        )
+        # Bounded wait: the per-call LLM timeouts plus retries should finish
+        # well inside this; without it one stuck turn pins the worker forever.
+        return future.result(timeout=120)
 
 
     # ---------------------------------------------------------------------
@@ -244,8 +437,8 @@ CURRENT USER STATE:
         """Fallback sync method"""
         try:
             user_profile = self.firebase_manager.get_user_profile(email)
-            recent_messages = self.message_manager.get_conversation(email, self.firebase_manager, limit=20)
-            last_messages = [msg.user_message.content for msg in recent_messages[-3:]] if recent_messages else [message]
+            recent_messages, _ = self.message_manager.get_conversation(email, self.firebase_manager, limit=20)
+            last_messages = self.message_manager.get_last_n_user_messages(email, self.firebase_manager, 3) or [message]
             topic_filter = self.health_filter.filter(last_messages)
             emotion, urgency_level = self.helper_manager.detect_emotion(message)
 
@@ -262,14 +455,16 @@ CURRENT USER STATE:
                 crisis = self.crisis_manager.handle_crisis_situation(email, message, self.firebase_manager)
                 return crisis.content
 
-            enhanced_prompt = f"""
-{self.system_prompt}
-
-CONVERSATION CONTEXT:
-{recent_messages}
+            user_state = f"""CURRENT USER STATE:
+- Emotion: {emotion}
+- Urgency: {urgency_level}/5
+- Name: {user_profile.name}
 """
 
-            messages = [SystemMessage(content=enhanced_prompt)]
+            messages = [
+                SystemMessage(content=self.system_prompt),
+                SystemMessage(content=user_state)
+            ]
 
             if recent_messages:
                 for msg_pair in recent_messages:
@@ -279,13 +474,14 @@ CONVERSATION CONTEXT:
             messages.append(HumanMessage(content=message))
 
             response = self.llm.invoke(messages)
-            return response.content
+            bot_message = response.content
 
-            asyncio.run(self.writer.submit(
+            # Persist synchronously — this fallback must not touch the event loop
+            self.writer.submit_sync(
                 self.message_manager.add_chat_pair,
                 email, message, bot_message, emotion, urgency_level
-            ))
-            asyncio.run(self.writer.submit(
+            )
+            self.writer.submit_sync(
                 self.message_manager.add_suggestions,
                 self.helper_manager,
                 emotion,
@@ -294,10 +490,10 @@ CONVERSATION CONTEXT:
                 self.firebase_manager,
                 self.message_manager,
                 message
-            ))
-            
+            )
+
             return bot_message
-            
+
         except Exception as e:
             logging.error(f"Sync error: {e}")
             raise
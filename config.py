@@ -1,6 +1,8 @@
 import os
+from typing import Optional
 from dotenv import load_dotenv
 from pydantic import BaseModel
+from langchain_google_genai import ChatGoogleGenerativeAI
 
 load_dotenv()
 
@@ -16,7 +18,88 @@ class Config(BaseModel):
     # Memory Configuration
     max_conversation_history: int = 50
     summary_trigger_length: int = 20
+    # Message pairs sent verbatim to the LLM; older turns are replaced by
+    # the stored daily summary to keep prompt size flat.
+    history_pairs_verbatim: int = 5
+
+    # Gemini rate-limit budget (requests/tokens per minute, in-flight calls)
+    rpm: int = int(os.getenv("RPM", "60"))
+    tpm: int = int(os.getenv("TPM", "250000"))
+    max_concurrency: int = int(os.getenv("MAX_CONCURRENCY", "8"))
     
     class Config:
         env_file = ".env"
 
+
+# One shared ChatGoogleGenerativeAI client per (model, temperature, max_tokens).
+# Re-creating clients per manager sets up a new HTTP session/gRPC channel each
+# time; sharing keeps connections alive across calls.
+_LLM_CACHE = {}
+
+
+def get_llm(temperature: float, max_tokens: Optional[int] = None,
+            response_mime_type: Optional[str] = None,
+            request_timeout: Optional[float] = None) -> ChatGoogleGenerativeAI:
+    """Return a cached ChatGoogleGenerativeAI client for the given settings.
+
+    response_mime_type="application/json" enables Gemini's native JSON mode
+    for calls that expect a small structured object. request_timeout bounds
+    each request so a hung backend can't hold a worker for minutes.
+    """
+    config = Config()
+    key = (config.model_name, temperature, max_tokens, response_mime_type, request_timeout)
+    if key not in _LLM_CACHE:
+        kwargs = {
+            "model": config.model_name,
+            "google_api_key": config.gemini_api_key,
+            "temperature": temperature,
+        }
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+        if response_mime_type is not None:
+            kwargs["response_mime_type"] = response_mime_type
+        if request_timeout is not None:
+            kwargs["timeout"] = request_timeout
+        _LLM_CACHE[key] = ChatGoogleGenerativeAI(**kwargs)
+    return _LLM_CACHE[key]
+
+
+# Transient backend failures worth retrying; anything else propagates to the
+# caller's existing fallback handling immediately.
+try:
+    from google.api_core.exceptions import DeadlineExceeded, ServiceUnavailable, ResourceExhausted
+    _RETRYABLE_EXCEPTIONS = (DeadlineExceeded, ServiceUnavailable, ResourceExhausted)
+except ImportError:  # pragma: no cover
+    _RETRYABLE_EXCEPTIONS = ()
+
+try:
+    from tenacity import (AsyncRetrying, Retrying, retry_if_exception_type,
+                          stop_after_attempt, wait_exponential_jitter)
+
+    def _retry_kwargs() -> dict:
+        return {
+            "stop": stop_after_attempt(3),
+            "wait": wait_exponential_jitter(initial=0.2, max=2),
+            "retry": retry_if_exception_type(_RETRYABLE_EXCEPTIONS),
+            "reraise": True,
+        }
+
+    def invoke_with_retry(llm, messages):
+        """llm.invoke with up to 3 attempts and jittered exponential backoff."""
+        for attempt in Retrying(**_retry_kwargs()):
+            with attempt:
+                return llm.invoke(messages)
+
+    async def ainvoke_with_retry(llm, messages):
+        """llm.ainvoke with up to 3 attempts and jittered exponential backoff."""
+        async for attempt in AsyncRetrying(**_retry_kwargs()):
+            with attempt:
+                return await llm.ainvoke(messages)
+
+except ImportError:  # pragma: no cover - no retries without tenacity
+    def invoke_with_retry(llm, messages):
+        return llm.invoke(messages)
+
+    async def ainvoke_with_retry(llm, messages):
+        return await llm.ainvoke(messages)
+
@@ -1,22 +1,48 @@
 from datetime import date
+import chatbot as chatbot_module
 from config import Config
 from managers.firebase_manager import FirebaseManager
 from managers.message import MessageManager
 from managers.summary import SummaryManager
+import asyncio
 import logging
-from typing import Union, Tuple
+from functools import lru_cache
+from typing import List, Union, Tuple
+
+
+# Lazy module-level singletons: building Config/FirebaseManager/SummaryManager
+# (which includes a Gemini client) once per process instead of once per user.
+
+@lru_cache(maxsize=1)
+def get_config() -> Config:
+    return Config()
+
+
+@lru_cache(maxsize=1)
+def get_firebase_manager() -> FirebaseManager:
+    return FirebaseManager()
+
+
+@lru_cache(maxsize=1)
+def get_message_manager() -> MessageManager:
+    return MessageManager(get_firebase_manager())
+
+
+@lru_cache(maxsize=1)
+def get_summary_manager() -> SummaryManager:
+    return SummaryManager(get_config(), get_firebase_manager().db)
 
 
 def run_daily_task_for_user(email: str) -> None:
-    
+
     try:
-        config = Config()
-        firebase_manager = FirebaseManager()
-        message_manager = MessageManager(firebase_manager)
-        summary_manager = SummaryManager(config, firebase_manager.db)
+        config = get_config()
+        firebase_manager = get_firebase_manager()
+        message_manager = get_message_manager()
+        summary_manager = get_summary_manager()
     except Exception as e:
         logging.error(f"Error initializing components for {email}: {e}", exc_info=True)
-        return 
+        return
 
     try:
         
@@ -31,9 +57,16 @@ def run_daily_task_for_user(email: str) -> None:
             last_message_date_str = last_message_time.strftime('%Y%m%d')
             
             
-            last_day_conversation = message_manager.get_conversation(
+            # Walk the conversation page by page (newest first) so memory
+            # stays bounded even on very long days.
+            last_day_conversation, cursor = message_manager.get_conversation(
                 email, firebase_manager, date=last_message_date_str
             )
+            while cursor is not None:
+                older_pairs, cursor = message_manager.get_conversation(
+                    email, firebase_manager, date=last_message_date_str, cursor=cursor
+                )
+                last_day_conversation = older_pairs + last_day_conversation
             
             
             if last_day_conversation:
@@ -50,17 +83,46 @@ def run_daily_task_for_user(email: str) -> None:
     
     
 
+async def run_daily_task_for_user_async(email: str, semaphore: asyncio.Semaphore) -> None:
+    """Async wrapper so daily tasks for many users can run concurrently."""
+    async with semaphore:
+        await asyncio.to_thread(run_daily_task_for_user, email)
+
+
+async def run_daily_tasks(emails: List[str], max_concurrency: int = 8) -> None:
+    """Run the daily task for all users concurrently, bounded by max_concurrency.
+
+    Wallclock drops from N x (Firestore RTT + LLM RTT) to roughly
+    N / max_concurrency; the semaphore keeps us inside Gemini's RPM tier.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = [asyncio.create_task(run_daily_task_for_user_async(email, semaphore)) for email in emails]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    for email, result in zip(emails, results):
+        if isinstance(result, Exception):
+            logging.error(f"Error processing daily task for {email}: {result}", exc_info=False)
+        else:
+            logging.info(f"Daily task completed for {email}")
+
+
 def send_notification(email: str) -> Union[str, Tuple[str, str]]:
     try:
-        config = Config()
-        firebase_manager = FirebaseManager()
-        message_manager = MessageManager(firebase_manager)
+        config = get_config()
+        firebase_manager = get_firebase_manager()
+        message_manager = get_message_manager()
     except Exception as e:
         logging.error(f"Error initializing components for {email}: {e}", exc_info=True)
         return "Error: Could not initialize components.", "Error: Initialization failed."
 
     try:
-        notification = message_manager.generate_notification_text(email, config, firebase_manager)
+        # Run the async variant on the shared chatbot loop (same pattern as
+        # chat_stream_handler): the profile and last-activity reads overlap
+        # and the Gemini call doesn't hold a thread.
+        notification = asyncio.run_coroutine_threadsafe(
+            message_manager.generate_notification_text_async(email, config, firebase_manager),
+            chatbot_module._LOOP
+        ).result()
         return notification
 
     except Exception as e:
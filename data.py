@@ -9,8 +9,19 @@ class Event(BaseModel):
     eventType: str  # 'exam', 'interview', 'appointment'
     description: str  
     eventDate: str  
-    mentionedAt: str = Field(default_factory=lambda: datetime.now().isoformat())  
-    isCompleted: bool = False 
+    mentionedAt: str = Field(default_factory=lambda: datetime.now().isoformat())
+    isCompleted: bool = False
+
+    def to_firestore_dict(self) -> dict:
+        """Plain-dict serialization for Firestore writes, skipping model_dump machinery."""
+        return {
+            'eventid': self.eventid,
+            'eventType': self.eventType,
+            'description': self.description,
+            'eventDate': self.eventDate,
+            'mentionedAt': self.mentionedAt,
+            'isCompleted': self.isCompleted,
+        }
 
 
 class UserProfile(BaseModel):
@@ -40,9 +51,36 @@ class MessagePair(BaseModel):
     """One message pair containing both user message and LLM response."""
     user_message: UserMessage
     llm_message: LLMMessage
-    timestamp: datetime = Field(default_factory=datetime.now) 
+    timestamp: datetime = Field(default_factory=datetime.now)
     conversation_id: Optional[str] = None
 
+    @classmethod
+    def model_construct_from_firestore(cls, pair_data: dict, conversation_id: Optional[str] = None) -> "MessagePair":
+        """Build a MessagePair from an already-trusted Firestore dict, skipping validation.
+
+        Firestore payloads were validated on the write path, so re-running
+        three pydantic validations per pair on every read is wasted CPU.
+        The camelCase lookups only fire for documents written before the
+        ingest path standardized on snake_case.
+        """
+        g = pair_data.get
+        user_message = UserMessage.model_construct(
+            content=g('user', ''),
+            emotion_detected=g('emotion_detected') or g('emotionDetected'),
+            urgency_level=g('urgency_level') or g('urgencyLevel', 1)
+        )
+        llm_message = LLMMessage.model_construct(
+            content=g('model', ''),
+            suggestions=g('suggestions', []),
+            follow_up_questions=g('follow_up_questions', [])
+        )
+        return cls.model_construct(
+            user_message=user_message,
+            llm_message=llm_message,
+            timestamp=g('timestamp', datetime.now()),
+            conversation_id=conversation_id
+        )
+
 
 class ConversationMemory(BaseModel):
     """Memory structure for conversation history."""
@@ -56,4 +94,29 @@ class MentalHealthTopicFilter(BaseModel):
     """Filter for mental health related topics."""
     is_mental_health_related: bool
     confidence_score: float = Field(ge=0.0, le=1.0)
-    reason: str = ""
\ No newline at end of file
+    reason: str = ""
+
+
+class FusedEvent(BaseModel):
+    """Event fields extracted as part of a fused conversation turn."""
+    has_event: bool = False
+    event_type: str = ""
+    event_date: str = ""
+    confidence: float = 0.0
+
+
+class TurnMetadata(BaseModel):
+    """Classification-only result for the streaming path (no reply field)."""
+    emotion: str = "neutral"
+    urgency: int = Field(default=1, ge=1, le=5)
+    is_mental_health: bool = True
+    event: Optional[FusedEvent] = None
+
+
+class FusedTurnResult(BaseModel):
+    """Combined result of one fused Gemini call: classification + reply."""
+    emotion: str = "neutral"
+    urgency: int = Field(default=1, ge=1, le=5)
+    is_mental_health: bool = True
+    event: Optional[FusedEvent] = None
+    reply: str = ""
\ No newline at end of file
@@ -2,22 +2,68 @@ import asyncio
 import logging
 
 class FirebaseWriter:
-    def __init__(self):
+    """Background queue for Firestore writes with a time/size-bounded flush loop."""
+
+    def __init__(self, max_batch: int = 20, flush_ms: int = 50, loop=None):
         self.queue = asyncio.Queue()
+        self.max_batch = max_batch
+        self.flush_ms = flush_ms
+        self.loop = loop
         self._start_worker()
 
     def _start_worker(self):
-        asyncio.create_task(self._worker())
+        if self.loop is not None:
+            # Constructed off-loop (e.g. module import): schedule the worker
+            # onto the persistent loop so it survives across requests.
+            asyncio.run_coroutine_threadsafe(self._worker(), self.loop)
+        else:
+            asyncio.create_task(self._worker())
 
     async def _worker(self):
         while True:
-            func, args, kwargs = await self.queue.get()
+            # Block for the first item, then drain more for up to flush_ms
+            # so writes queued close together share one flush.
+            items = [await self.queue.get()]
+            while len(items) < self.max_batch:
+                try:
+                    items.append(
+                        await asyncio.wait_for(self.queue.get(), timeout=self.flush_ms / 1000)
+                    )
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(items)
+
+    async def _flush(self, items):
+        for kind, payload in items:
             try:
-                await asyncio.to_thread(func, *args, **kwargs)
+                if kind == "many":
+                    for func, args, kwargs in payload:
+                        try:
+                            await asyncio.to_thread(func, *args, **kwargs)
+                        except Exception as e:
+                            logging.error(f"Firestore write failed: {e}")
+                else:
+                    func, args, kwargs = payload
+                    await asyncio.to_thread(func, *args, **kwargs)
             except Exception as e:
                 logging.error(f"Firestore write failed: {e}")
             finally:
                 self.queue.task_done()
 
     async def submit(self, func, *args, **kwargs):
-        await self.queue.put((func, args, kwargs))
+        await self.queue.put(("call", (func, args, kwargs)))
+
+    def submit_sync(self, func, *args, **kwargs):
+        """Run a write immediately on the calling thread (for fully-sync fallbacks)."""
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            logging.error(f"Firestore write failed: {e}")
+
+    async def submit_many(self, ops):
+        """Queue several (func, args, kwargs) ops as a single queue item.
+
+        All ops from one turn land in the same flush instead of paying a
+        queue put + task wakeup each.
+        """
+        await self.queue.put(("many", list(ops)))
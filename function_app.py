@@ -3,11 +3,10 @@ import logging
 import json
 from datetime import datetime, timezone
 import asyncio
-from daily import run_daily_task_for_user,send_notification
+from daily import run_daily_tasks,send_notification,get_firebase_manager
 
-from managers.firebase_manager import FirebaseManager
-
-from main import android_chat
+from main import android_chat, chatbot
+import chatbot as chatbot_module
 
 
 app = func.FunctionApp()
@@ -37,7 +36,7 @@ def check_firebase(req: func.HttpRequest) -> func.HttpResponse:
         return func.HttpResponse("", status_code=204, headers=CORS_HEADERS)
 
     try:
-        firebase_manager = FirebaseManager()
+        firebase_manager = get_firebase_manager()
         if firebase_manager.db:
             return func.HttpResponse(
                 json.dumps({"status": "Firebase is initialized and working."}),
@@ -108,6 +107,61 @@ def chat_handler(req: func.HttpRequest) -> func.HttpResponse:
         
         
         
+@app.route(route="chat_stream", auth_level=func.AuthLevel.FUNCTION)
+def chat_stream_handler(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Chat endpoint returning the reply as SSE frames generated from the
+    streaming pipeline (the reply is produced and persisted incrementally;
+    func.HttpResponse still delivers the frames in one body).
+    """
+    logging.info('Chat stream handler function processed a request.')
+
+    if req.method == "OPTIONS":
+        return func.HttpResponse("", status_code=204, headers=CORS_HEADERS)
+
+    try:
+        try:
+            req_body = req.get_json()
+            email = req_body.get('email')
+            message = req_body.get('message')
+        except ValueError:
+            return func.HttpResponse(
+                json.dumps({"error": "Invalid JSON format."}),
+                status_code=400, mimetype="application/json", headers=CORS_HEADERS
+            )
+
+        if not email or not message:
+            return func.HttpResponse(
+                json.dumps({"error": "Please provide 'email' and 'message'."}),
+                status_code=400, mimetype="application/json", headers=CORS_HEADERS
+            )
+
+        async def _collect_frames():
+            frames = []
+            async for chunk in chatbot.process_conversation_stream(email, message):
+                frames.append(f"data: {json.dumps({'delta': chunk})}\n\n")
+            frames.append("data: [DONE]\n\n")
+            return "".join(frames)
+
+        body = asyncio.run_coroutine_threadsafe(
+            _collect_frames(), chatbot_module._LOOP
+        ).result()
+
+        return func.HttpResponse(
+            body,
+            mimetype="text/event-stream",
+            status_code=200,
+            headers=CORS_HEADERS
+        )
+
+    except Exception as e:
+        logging.error(f"An error occurred in chat_stream_handler: {e}", exc_info=True)
+        return func.HttpResponse(
+            json.dumps({"error": "An internal server error occurred."}),
+            status_code=500, mimetype="application/json", headers=CORS_HEADERS
+        )
+
+
 @app.route(route="notification", auth_level=func.AuthLevel.FUNCTION)
 def notification_handler(req: func.HttpRequest) -> func.HttpResponse:
     
@@ -166,19 +220,14 @@ def daily_task_timer(timer: func.TimerRequest) -> None:
     logging.info('Daily Task Timer function is executing.')
 
     try:
-        firebase_manager = FirebaseManager()
+        firebase_manager = get_firebase_manager()
         all_user_emails = firebase_manager.get_all_user_emails()
         
         
         if not all_user_emails:
             logging.info("No users found in the database. Timer task finished.")
             return
-        
-        for email in all_user_emails:
-            try:
-                run_daily_task_for_user(email)
-                logging.info(f"Daily task completed for {email}")
-            except Exception as e:
-                logging.error(f"Error processing daily task for {email}: {e}", exc_info=True)
+
+        asyncio.run(run_daily_tasks(all_user_emails))
     except Exception as e:
         logging.error(f"The timer trigger failed with an exception: {e}", exc_info=True)
\ No newline at end of file
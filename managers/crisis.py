@@ -3,35 +3,21 @@ Crisis Management Module
 Handles crisis intervention and error handling for the mental health chatbot
 """
 
-import json
-from langchain_google_genai import ChatGoogleGenerativeAI
+import asyncio
 from langchain_core.messages import SystemMessage, HumanMessage
+from config import ainvoke_with_retry, get_llm, invoke_with_retry
 from data import LLMMessage
+from managers.json_utils import extract_json
 
 
-
-class CrisisManager:
-    """Manages crisis intervention and error handling responses."""
-    
-    def __init__(self,config):
-        """Initialize the CrisisManager with LLM for response generation."""
-        self.llm = ChatGoogleGenerativeAI(
-            model=config.model_name,
-            google_api_key=config.gemini_api_key,
-            temperature=0.7 
-        )
-    
-    def handle_crisis_situation(self, user_email: str, message: str,firebase_manager) -> LLMMessage:
-        """Handle crisis situations with immediate support and resources using LLM."""
-        user_profile = firebase_manager.get_user_profile(user_email)
-        name = user_profile.name 
-        
-        # Generate complete crisis response using single LLM call
-        system_prompt = f"""You are Sorea, a caring friend responding to someone in severe emotional crisis. Generate a complete crisis intervention response with all components.
+# Static crisis prompt: kept byte-identical across calls (no interpolation)
+# so provider prompt caches can reuse the prefix. All per-user values are
+# passed in the HumanMessage instead.
+_CRISIS_SYSTEM_PROMPT = """You are Sorea, a caring friend responding to someone in severe emotional crisis. Generate a complete crisis intervention response with all components. The person's name and their crisis message are provided in the user message.
 
         CRISIS RESPONSE REQUIREMENTS:
         1. IMMEDIATELY show deep concern and love for them
-        2. Acknowledge their pain without minimizing it  
+        2. Acknowledge their pain without minimizing it
         3. Fight against harmful thoughts with protective, loving energy
         4. Include essential crisis resources (MUST include these exactly):
            - Call 988 (Suicide & Crisis Lifeline) - Available 24/7
@@ -49,13 +35,9 @@ class CrisisManager:
         - Challenge negative thoughts with love and reality
         - Make it personal - this is about THEM specifically
 
-        USER CONTEXT:
-        - Name: {name}
-        - Crisis message: "{message}"
-
         RESPONSE FORMAT:
         Return your response as a JSON object with this EXACT structure:
-        {{
+        {
             "crisis_response": "The main crisis intervention message (include all crisis resources)",
             "suggestions": [
                 "Immediate actionable suggestion 1",
@@ -65,7 +47,7 @@ class CrisisManager:
                 "Caring urgent question about safety?",
                 "Personal question encouraging immediate action?"
             ]
-        }}
+        }
 
         SUGGESTIONS should be:
         - IMMEDIATE safety-focused actions they can take right now
@@ -83,43 +65,168 @@ class CrisisManager:
 
         Generate a powerful, loving response that could save their life."""
 
-        try:
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=f"Generate a complete crisis intervention response for {name} who said: '{message}'. Return as JSON.")
+
+# Narrower prompts for the parallel async path: the long-form intervention
+# text and the short suggestions/questions JSON are generated concurrently,
+# so wall time is the max of the two calls instead of their sum.
+_CRISIS_MAIN_PROMPT = """You are Sorea, a caring friend responding to someone in severe emotional crisis. Generate the main crisis intervention message. The person's name and their crisis message are provided in the user message.
+
+        CRISIS RESPONSE REQUIREMENTS:
+        1. IMMEDIATELY show deep concern and love for them
+        2. Acknowledge their pain without minimizing it
+        3. Fight against harmful thoughts with protective, loving energy
+        4. Include essential crisis resources (MUST include these exactly):
+           - Call 988 (Suicide & Crisis Lifeline) - Available 24/7
+           - Text HOME to 741741 (Crisis Text Line)
+           - Call 911 if in immediate danger
+           - Go to nearest emergency room
+        5. Emphasize their value and that people care about them
+        6. Show urgency about getting help TODAY
+        7. Use their name naturally and personally
+
+        TONE GUIDELINES:
+        - Be passionately protective, like fighting for a family member
+        - Show genuine fear for their safety while remaining strong
+        - Be direct and urgent but not clinical
+        - Challenge negative thoughts with love and reality
+        - Make it personal - this is about THEM specifically
+
+        Respond with the crisis intervention message text ONLY — no JSON, no markdown, no headers. Generate a powerful, loving response that could save their life."""
+
+_CRISIS_META_PROMPT = """You are Sorea, a caring friend responding to someone in severe emotional crisis. Generate ONLY the immediate suggestions and follow-up questions for this crisis. The person's name and their crisis message are provided in the user message.
+
+        SUGGESTIONS should be:
+        - IMMEDIATE safety-focused actions they can take right now
+        - Specific and actionable (not vague)
+        - Appropriate for crisis level urgency
+        - Mix of professional help and personal support
+        - Focus on TODAY - immediate actions
+
+        FOLLOW-UP QUESTIONS should:
+        - Check their immediate safety and support systems
+        - Encourage immediate action for getting help
+        - Be personal and caring, using their name
+        - Focus on RIGHT NOW - immediate needs
+        - Help assess their current safety situation
+
+        Return ONLY a JSON object with this EXACT structure:
+        {
+            "suggestions": [
+                "Immediate actionable suggestion 1",
+                "Immediate actionable suggestion 2"
+            ],
+            "follow_up_questions": [
+                "Caring urgent question about safety?",
+                "Personal question encouraging immediate action?"
             ]
-            
-            response = self.llm.invoke(messages)
-            response_text = response.content.strip()
-        
-            try:
-                # Extract JSON from response if wrapped in markdown
-                if '```json' in response_text:
-                    start = response_text.find('{')
-                    end = response_text.rfind('}') + 1
-                    json_str = response_text[start:end]
-                elif '{' in response_text and '}' in response_text:
-                    start = response_text.find('{')
-                    end = response_text.rfind('}') + 1
-                    json_str = response_text[start:end]
-                else:
-                    raise ValueError("No JSON found in response")
-                
-                crisis_data = json.loads(json_str)
-                
-                return LLMMessage(
-                    content=crisis_data.get('crisis_response', ''),
-                    suggestions=crisis_data.get('suggestions', []),
-                    follow_up_questions=crisis_data.get('follow_up_questions', [])
-                )
-                
-            except (json.JSONDecodeError, ValueError, KeyError) as json_error:
-                raise Exception(f"JSON parsing failed: {json_error}")
-            
-        except Exception as e:
-            fallback_name = name if 'name' in locals() else "friend"
-            fallback_message = (
-                f"What's really on your heart right now, {fallback_name}? "
-                "How can I best support you today?"
+        }"""
+
+
+class CrisisManager:
+    """Manages crisis intervention and error handling responses."""
+    
+    def __init__(self,config):
+        """Initialize the CrisisManager with the shared LLM client."""
+        self.llm = get_llm(temperature=0.7, request_timeout=15.0)
+        # Tight token budget so the suggestions/questions call returns fast
+        self.meta_llm = get_llm(temperature=0.7, max_tokens=200, request_timeout=15.0)
+    
+    def handle_crisis_situation(self, user_email: str, message: str,firebase_manager) -> LLMMessage:
+        """Handle crisis situations with immediate support and resources using LLM."""
+        user_profile = firebase_manager.get_user_profile(user_email)
+        name = user_profile.name
+
+        try:
+            messages = self._build_crisis_messages(name, message)
+            response = invoke_with_retry(self.llm, messages)
+            return self._parse_crisis_response(response.content, name)
+        except Exception:
+            return self._fallback_message(name)
+
+    async def handle_crisis_situation_async(self, user_email: str, message: str, firebase_manager) -> LLMMessage:
+        """Async variant: the long intervention text and the short
+        suggestions/questions JSON are generated in two parallel calls, so
+        wall time is the max of the two instead of one monolithic response."""
+        user_profile = await asyncio.to_thread(firebase_manager.get_user_profile, user_email)
+        name = user_profile.name
+
+        user_context = (
+            f"USER CONTEXT:\n- Name: {name}\n- Crisis message: \"{message}\""
+        )
+
+        try:
+            main_response, meta_response = await asyncio.gather(
+                ainvoke_with_retry(self.llm, [
+                    SystemMessage(content=_CRISIS_MAIN_PROMPT),
+                    HumanMessage(content=f"{user_context}\n\nGenerate the crisis intervention message for {name}.")
+                ]),
+                ainvoke_with_retry(self.meta_llm, [
+                    SystemMessage(content=_CRISIS_META_PROMPT),
+                    HumanMessage(content=f"{user_context}\n\nGenerate the suggestions and follow-up questions for {name}. Return as JSON.")
+                ])
+            )
+
+            content = main_response.content.strip()
+            if not content:
+                return self._fallback_message(name)
+
+            meta_data = extract_json(meta_response.content) or {}
+            return LLMMessage(
+                content=content,
+                suggestions=meta_data.get('suggestions', []),
+                follow_up_questions=meta_data.get('follow_up_questions', [])
             )
-            return LLMMessage(content=fallback_message)
+        except Exception:
+            return self._fallback_message(name)
+
+    async def handle_crisis_situation_stream(self, user_email: str, message: str, firebase_manager):
+        """Streaming variant: yields str chunks as Gemini produces them, then the
+        parsed LLMMessage once the full response has arrived.
+
+        Callers that can render progressively show first words in a few hundred
+        ms instead of waiting out the whole generation; buffering callers can
+        just keep the final LLMMessage.
+        """
+        user_profile = await asyncio.to_thread(firebase_manager.get_user_profile, user_email)
+        name = user_profile.name
+
+        buffer = []
+        try:
+            async for chunk in self.llm.astream(self._build_crisis_messages(name, message)):
+                if chunk.content:
+                    buffer.append(chunk.content)
+                    yield chunk.content
+            yield self._parse_crisis_response("".join(buffer), name)
+        except Exception:
+            yield self._fallback_message(name)
+
+    def _build_crisis_messages(self, name: str, message: str) -> list:
+        """Build the crisis intervention prompt messages."""
+        return [
+            SystemMessage(content=_CRISIS_SYSTEM_PROMPT),
+            HumanMessage(content=(
+                f"USER CONTEXT:\n- Name: {name}\n- Crisis message: \"{message}\"\n\n"
+                f"Generate a complete crisis intervention response for {name}. Return as JSON."
+            ))
+        ]
+
+    def _parse_crisis_response(self, response_text: str, name: str) -> LLMMessage:
+        """Extract the crisis JSON from the raw LLM response."""
+        # Bracket-depth scan handles markdown fences and nested braces
+        crisis_data = extract_json(response_text)
+        if crisis_data is None:
+            raise ValueError("No JSON found in response")
+
+        return LLMMessage(
+            content=crisis_data.get('crisis_response', ''),
+            suggestions=crisis_data.get('suggestions', []),
+            follow_up_questions=crisis_data.get('follow_up_questions', [])
+        )
+
+    def _fallback_message(self, name: str) -> LLMMessage:
+        fallback_name = name if name else "friend"
+        fallback_message = (
+            f"What's really on your heart right now, {fallback_name}? "
+            "How can I best support you today?"
+        )
+        return LLMMessage(content=fallback_message)
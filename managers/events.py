@@ -3,28 +3,122 @@ Event Management Module
 Handles detection, storage, and follow-up of important events in conversations
 """
 
+import asyncio
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta, datetime
-from typing import Optional, List
-from langchain_google_genai import ChatGoogleGenerativeAI
+from typing import Dict, Optional, List
+from google.cloud.firestore import FieldFilter
 from langchain_core.messages import SystemMessage, HumanMessage
+from config import ainvoke_with_retry, get_llm, invoke_with_retry
 from data import Event
+from managers.json_utils import extract_json
+from managers.response_cache import ResponseCache
 import hashlib
+import re
 from datetime import datetime
 import logging
 
+try:
+    import xxhash
+
+    def _short_hash(data: bytes) -> str:
+        """6-hex-char non-cryptographic id fragment (xxh3 is ~10x faster than md5)."""
+        return xxhash.xxh3_64_hexdigest(data)[:6]
+except ImportError:  # pragma: no cover - fallback when xxhash isn't installed
+    def _short_hash(data: bytes) -> str:
+        """6-hex-char id fragment via md5 when xxhash is unavailable."""
+        return hashlib.md5(data).hexdigest()[:6]
+
+
+# Static extraction prompt: kept byte-identical across calls (no date or
+# message interpolation) so provider prompt caches can reuse the prefix.
+# The concrete dates arrive as a DATE CONTEXT preamble in the HumanMessage.
+_EXTRACTION_SYSTEM_PROMPT = """You are an expert at detecting important upcoming events or recent events that someone might want follow-up on. The user message starts with a DATE CONTEXT JSON object giving today's date and precomputed reference dates. Analyze the user's message and determine:
+
+        1. If there's an important event mentioned (exam, interview, appointment, date, presentation, meeting, deadline, party, etc.)
+        2. The type of event (be specific but use common categories)
+        3. The timing context (when it's happening or happened)
+
+        IMPORTANT: Only detect events that are:
+        - Significant enough that a caring friend would follow up about
+        - Have clear timing indicators (today, tomorrow, next week, yesterday, etc.)
+        - Are specific events, not general activities
+
+        Return your analysis in this EXACT JSON format:
+        {
+            "has_event": true/false,
+            "event_type": "exam" or "interview" or "appointment" or "date" or "presentation" or "meeting" or "deadline" or "party" or "other",
+            "event_date": "YYYY-MM-DD" (calculate the actual date based on timing context),
+            "confidence": 0.0-1.0
+        }
+
+        Only return has_event: true if you're confident (>0.7) there's a real important event with timing.
+
+        For event_date calculation, use the DATE CONTEXT values:
+        - "today" → the "today" value
+        - "tomorrow" → the "tomorrow" value
+        - "yesterday" → the "yesterday" value
+        - "next week" → the "next_week" value (7 days from today)
+        - "this weekend" → calculate Saturday/Sunday of this week from "today" and "weekday"
+        - "next Monday/Tuesday/etc" → calculate the next occurrence of that day
+        - Specific dates mentioned in the message should be converted to YYYY-MM-DD format"""
+
+
+# Static greeting prompt, also interpolation-free: the name, date and event
+# list arrive as an EVENT CONTEXT block in the HumanMessage.
+_GREETING_SYSTEM_PROMPT = """You are Sorea, a caring friend who remembers important events in people's lives. Generate a warm, personalized greeting that asks about multiple important events. The person's name, today's date and the events to follow up on are provided in the user message.
+
+        GUIDELINES:
+        - Be genuinely caring and show you remember all the events
+        - Use natural, friendly language like you're texting a close friend
+        - Show appropriate emotion (excitement, concern, encouragement) for the event types
+        - Keep it conversational and warm, not formal
+        - Reference the timing naturally based on the date comparisons
+        - Make it feel personal and thoughtful
+        - If there are multiple events, weave them together naturally or focus on the most relevant one
+        - Write the person's name as the literal placeholder {NAME} wherever it should appear — it is substituted in afterwards
+
+        Generate ONE natural, caring greeting message that shows you remember and care about their events."""
+
+
+# Deterministic fast path: a single unambiguous event type plus a plain
+# today/tomorrow marker needs no LLM at all.
+_EVENT_TYPE_RE = re.compile(
+    r"\b(exam|test|interview|appointment|meeting|presentation|deadline|party|birthday)\b",
+    re.IGNORECASE
+)
+_RELATIVE_DAY_RE = re.compile(r"\b(today|tomorrow)\b", re.IGNORECASE)
+
+# Cheap prefilter: only messages that plausibly mention an event are worth
+# an LLM extraction call. Most chat turns ("hi", "thanks") match nothing.
+_EVENT_KEYWORDS = re.compile(
+    r"\b(exam|test|interview|appointment|meeting|presentation|deadline|date|party|birthday|"
+    r"today|tomorrow|yesterday|tonight|weekend|next\s+(week|month|monday|tuesday|wednesday|thursday|friday|saturday|sunday)|"
+    r"\d{1,2}(st|nd|rd|th)?\s+(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec))\b",
+    re.IGNORECASE
+)
+
 
 class EventManager:
     """Manages event detection, storage, and proactive follow-ups."""
     
     def __init__(self,config,firebase_manager):
-        """Initialize the EventManager with LLM for event detection."""
-        self.llm = ChatGoogleGenerativeAI(
-            model=config.model_name,
-            google_api_key=config.gemini_api_key,
-            temperature=0.3 
-        )
-        self.db = firebase_manager.db 
+        """Initialize the EventManager with the shared LLM client."""
+        self.llm = get_llm(temperature=0.3, request_timeout=15.0)
+        # Extraction expects a tiny JSON object; cap decode length and use
+        # Gemini's native JSON mode so no prose can precede the object
+        self.extract_llm = get_llm(temperature=0.3, max_tokens=80,
+                                   response_mime_type="application/json",
+                                   request_timeout=6.0)
+        self.db = firebase_manager.db
+        # DATE CONTEXT preamble only changes at midnight; cache it per day
+        self._date_context_cache = (None, None)
+        self._date_context_lock = threading.Lock()
+        # Greeting templates keyed by (event_type, days_until) signature; the
+        # signature shifts at midnight so stale timing language can't leak
+        self._greeting_cache = ResponseCache(maxsize=512, ttl=86400.0)
     
     def add_event(self, email: str, event: Event):
         """Add an event to Firestore using subcollection."""
@@ -32,13 +126,29 @@ class EventManager:
             return
         
         try:
-            event_data = event.model_dump()
+            event_data = event.to_firestore_dict()
             doc_ref = self.db.collection('users').document(email).collection('events').document(event.eventid)
             doc_ref.set(event_data)
             
         except Exception as e:
             logging.error(f"Error adding event: {e}")
-    
+
+    def add_events(self, email: str, events: List[Event]):
+        """Add multiple events in a single batched commit."""
+        if not self.db or not events:
+            return
+
+        try:
+            events_ref = self.db.collection('users').document(email).collection('events')
+            batch = self.db.batch()
+            for event in events:
+                batch.set(events_ref.document(event.eventid), event.to_firestore_dict())
+            batch.commit()
+
+        except Exception as e:
+            logging.error(f"Error adding events: {e}")
+
+
     def get_events(self, email: str) -> List[Event]:
         """Get all events for user."""
         if not self.db:
@@ -72,156 +182,343 @@ class EventManager:
         
         return []
 
-    def _extract_events_with_llm(self, message: str, email: str) -> Optional[Event]:
-        """Use LLM to extract events and timing from user messages."""
-        today = datetime.now()
-        tomorrow = today + timedelta(days=1)
-        yesterday = today - timedelta(days=1)
-        next_week = today + timedelta(days=7)
-        
-        system_prompt = f"""You are an expert at detecting important upcoming events or recent events that someone might want follow-up on. Analyze the user's message and determine:
+    def get_events_for_users(self, emails: List[str]) -> Dict[str, List[Event]]:
+        """Fetch events for many users in parallel.
 
-        1. If there's an important event mentioned (exam, interview, appointment, date, presentation, meeting, deadline, party, etc.)
-        2. The type of event (be specific but use common categories)
-        3. The timing context (when it's happening or happened)
+        The Firestore client is thread-safe, so sweep jobs can fan per-user
+        reads across a thread pool instead of scanning users one at a time.
+        """
+        if not self.db or not emails:
+            return {}
 
-        IMPORTANT: Only detect events that are:
-        - Significant enough that a caring friend would follow up about
-        - Have clear timing indicators (today, tomorrow, next week, yesterday, etc.)
-        - Are specific events, not general activities
+        with ThreadPoolExecutor(max_workers=min(40, len(emails))) as executor:
+            results = executor.map(self.get_events, emails)
 
-        TODAY'S DATE: {today.strftime('%Y-%m-%d')} ({today.strftime('%A')})
+        return dict(zip(emails, results))
 
-        Return your analysis in this EXACT JSON format:
-        {{
-            "has_event": true/false,
-            "event_type": "exam" or "interview" or "appointment" or "date" or "presentation" or "meeting" or "deadline" or "party" or "other",
-            "event_date": "YYYY-MM-DD" (calculate the actual date based on timing context),
-            "confidence": 0.0-1.0
-        }}
+    def get_upcoming_events_for_all_users(self) -> Dict[str, List[Event]]:
+        """Fetch every user's upcoming events with one collection-group query.
 
-        Only return has_event: true if you're confident (>0.7) there's a real important event with timing.
-        
-        For event_date calculation, use today's date as {today.strftime('%Y-%m-%d')} and calculate:
-        - "today" → {today.strftime('%Y-%m-%d')}
-        - "tomorrow" → {tomorrow.strftime('%Y-%m-%d')}
-        - "yesterday" → {yesterday.strftime('%Y-%m-%d')}
-        - "next week" → {next_week.strftime('%Y-%m-%d')} (7 days from today)
-        - "this weekend" → calculate Saturday/Sunday of this week
-        - "next Monday/Tuesday/etc" → calculate the next occurrence of that day
-        - Specific dates mentioned in the message should be converted to YYYY-MM-DD format"""
+        Replaces the N-per-user scan for sweep jobs: a single query over the
+        'events' subcollections filtered to dates from today onward.
+        """
+        if not self.db:
+            return {}
+
+        today_str = date.today().strftime('%Y-%m-%d')
 
         try:
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=f"Analyze this message for important events: '{message}'")
-            ]
-            
-            response = self.llm.invoke(messages)
-            response_text = response.content.strip()
-            
+            query = self.db.collection_group('events').where(
+                filter=FieldFilter('eventDate', '>=', today_str)
+            )
+            return self._group_events_by_user(query)
+
+        except Exception as e:
+            logging.error(f"Error getting upcoming events: {e}")
+
+        return {}
+
+    def get_events_due_today(self) -> Dict[str, List[Event]]:
+        """Fetch every user's events due today with one collection-group query.
+
+        The proactive follow-up sweep makes ONE RPC regardless of user count,
+        instead of get_all_user_emails plus get_events per user.
+        """
+        if not self.db:
+            return {}
+
+        today_str = date.today().strftime('%Y-%m-%d')
+
+        try:
+            query = self.db.collection_group('events').where(
+                filter=FieldFilter('eventDate', '==', today_str)
+            )
+            return self._group_events_by_user(query)
+
+        except Exception as e:
+            logging.error(f"Error getting events due today: {e}")
+
+        return {}
+
+    @staticmethod
+    def _group_events_by_user(query) -> Dict[str, List[Event]]:
+        """Stream a collection-group query and group parsed events by user email."""
+        events_by_user: Dict[str, List[Event]] = {}
+        for doc in query.stream():
+            event_data = doc.to_dict()
+
             try:
-                if '{' in response_text and '}' in response_text:
-                    start = response_text.find('{')
-                    end = response_text.rfind('}') + 1
-                    json_str = response_text[start:end]
-                    event_data = json.loads(json_str)
-                    
-                    if isinstance(event_data, dict) and 'has_event' in event_data:
-                        confidence = event_data.get('confidence', 0.0)
-                        if event_data.get('has_event') and confidence >= 0.7:
-                            event_date_str = event_data.get('event_date') 
-                            event_type = event_data.get('event_type', 'event')
-                            base_components = [
-                                event_type.lower().replace(' ', '_'),
-                                email.split('@')[0],  
-                                event_date_str
-                            ]
-                            description_hash = hashlib.md5(message.encode()).hexdigest()[:6]
-                            event_id = f"{base_components[0]}_{base_components[1]}_{base_components[2]}_{description_hash}"
-                    
-                            return Event(
-                                eventid=event_id,
-                                eventType=event_type,
-                                description=message,
-                                eventDate=event_date_str,
-                                isCompleted=False
-                            )
-                        
-            except json.JSONDecodeError:
-                pass
-                
+                event = Event(
+                    eventid=doc.id,
+                    eventType=event_data.get('eventType', ''),
+                    description=event_data.get('description', ''),
+                    eventDate=event_data.get('eventDate'),
+                    mentionedAt=event_data.get('mentionedAt', ''),
+                    isCompleted=event_data.get('isCompleted', False)
+                )
+            except Exception as parse_error:
+                logging.warning(f"Could not parse event {doc.id}: {parse_error}")
+                continue
+
+            # events live at users/{email}/events/{eventid}
+            email = doc.reference.parent.parent.id
+            events_by_user.setdefault(email, []).append(event)
+
+        return events_by_user
+
+    def build_event(self, email: str, message: str, event_type: str, event_date_str: str) -> Optional[Event]:
+        """Build an Event from already-extracted fields (e.g. from a fused LLM call)."""
+        if not event_type or not event_date_str:
             return None
-            
+
+        base_components = [
+            event_type.lower().replace(' ', '_'),
+            email.split('@')[0],
+            event_date_str
+        ]
+        description_hash = _short_hash(message.encode())
+        event_id = f"{base_components[0]}_{base_components[1]}_{base_components[2]}_{description_hash}"
+
+        return Event(
+            eventid=event_id,
+            eventType=event_type,
+            description=message,
+            eventDate=event_date_str,
+            isCompleted=False
+        )
+
+    def _date_context_preamble(self) -> str:
+        """Serialized DATE CONTEXT for today, rebuilt only when the day changes."""
+        today = date.today()
+        today_str = today.isoformat()
+
+        cached_day, preamble = self._date_context_cache
+        if cached_day != today_str:
+            with self._date_context_lock:
+                cached_day, preamble = self._date_context_cache
+                if cached_day != today_str:
+                    date_context = {
+                        "today": today_str,
+                        "weekday": today.strftime('%A'),
+                        "tomorrow": (today + timedelta(days=1)).isoformat(),
+                        "yesterday": (today - timedelta(days=1)).isoformat(),
+                        "next_week": (today + timedelta(days=7)).isoformat(),
+                    }
+                    preamble = f"DATE CONTEXT: {json.dumps(date_context)}"
+                    self._date_context_cache = (today_str, preamble)
+
+        return preamble
+
+    def _build_extraction_messages(self, message: str) -> list:
+        """Build the event-extraction prompt messages.
+
+        Date arithmetic is precomputed and passed as a small JSON preamble in
+        the HumanMessage so the system prompt stays byte-identical across
+        calls (and days) for provider prompt caching.
+        """
+        return [
+            SystemMessage(content=_EXTRACTION_SYSTEM_PROMPT),
+            HumanMessage(content=(
+                f"{self._date_context_preamble()}\n\n"
+                f"Analyze this message for important events: '{message}'"
+            ))
+        ]
+
+    def _parse_extraction_response(self, response_text: str, message: str, email: str) -> Optional[Event]:
+        """Parse the extraction JSON and build an Event if confident enough."""
+        event_data = extract_json(response_text)
+
+        if event_data is not None and 'has_event' in event_data:
+            confidence = event_data.get('confidence', 0.0)
+            if event_data.get('has_event') and confidence >= 0.7:
+                return self.build_event(
+                    email,
+                    message,
+                    event_data.get('event_type', 'event'),
+                    event_data.get('event_date')
+                )
+
+        return None
+
+    def _deterministic_event(self, message: str, email: str) -> Optional[Event]:
+        """Build an Event without any LLM call for unambiguous messages.
+
+        Handles the common "my exam is tomorrow" shape: exactly one event-type
+        keyword plus a plain today/tomorrow marker. Anything fuzzier (weekday
+        names, explicit dates, multiple event types) still goes to the LLM.
+        """
+        type_matches = {m.lower() for m in _EVENT_TYPE_RE.findall(message)}
+        day_matches = {m.lower() for m in _RELATIVE_DAY_RE.findall(message)}
+        if len(type_matches) != 1 or len(day_matches) != 1:
+            return None
+
+        event_date = date.today()
+        if day_matches.pop() == "tomorrow":
+            event_date += timedelta(days=1)
+
+        return self.build_event(email, message, type_matches.pop(), event_date.strftime('%Y-%m-%d'))
+
+    def _extract_events_with_llm(self, message: str, email: str) -> Optional[Event]:
+        """Use LLM to extract events and timing from user messages."""
+        # Skip the LLM entirely when no event keyword is present
+        if not _EVENT_KEYWORDS.search(message):
+            return None
+
+        event = self._deterministic_event(message, email)
+        if event is not None:
+            return event
+
+        try:
+            response = invoke_with_retry(self.extract_llm, self._build_extraction_messages(message))
+            return self._parse_extraction_response(response.content, message, email)
         except Exception as e:
             return None
 
+    async def _extract_events_with_llm_async(self, message: str, email: str) -> Optional[Event]:
+        """Async variant of _extract_events_with_llm using the LLM's native ainvoke."""
+        if not _EVENT_KEYWORDS.search(message):
+            return None
+
+        event = self._deterministic_event(message, email)
+        if event is not None:
+            return event
+
+        try:
+            response = await ainvoke_with_retry(self.extract_llm, self._build_extraction_messages(message))
+            return self._parse_extraction_response(response.content, message, email)
+        except Exception as e:
+            return None
+
+    def _build_greeting_messages(self, events: List[Event]) -> list:
+        """Build the event-greeting prompt messages.
+
+        The name is requested as a {NAME} placeholder and the per-user event
+        descriptions are left out, so the generated greeting is a reusable
+        template for every user with the same event types and timing.
+        """
+        today_str = date.today().strftime('%Y-%m-%d')
+
+        # Build event context for all events
+        events_text = "\n".join(
+            f"- {event.eventType} on {event.eventDate}"
+            for event in events
+        )
+
+        return [
+            SystemMessage(content=_GREETING_SYSTEM_PROMPT),
+            HumanMessage(content=(
+                f"EVENT CONTEXT:\n"
+                f"- Person's name: {{NAME}}\n"
+                f"- Today's date: {today_str}\n"
+                f"- Events to follow up on:\n{events_text}\n\n"
+                "Generate a caring greeting for {NAME} about these events. "
+                "Compare the dates and generate appropriate timing language."
+            ))
+        ]
+
+    @staticmethod
+    def _clean_greeting(greeting: str) -> str:
+        """Strip surrounding quotes the LLM sometimes adds around the greeting."""
+        if greeting.startswith('"') and greeting.endswith('"'):
+            greeting = greeting[1:-1]
+        return greeting
+
+    @staticmethod
+    def _greeting_signature(events: List[Event]) -> Optional[tuple]:
+        """Canonical (event_type, days_until) signature shared by equivalent greetings."""
+        try:
+            today = date.today()
+            return tuple(sorted(
+                (event.eventType.lower(), (date.fromisoformat(event.eventDate) - today).days)
+                for event in events
+            ))
+        except (TypeError, ValueError):
+            return None
+
+    def _cached_greeting_template(self, signature: Optional[tuple]) -> Optional[str]:
+        if signature is None:
+            return None
+        return self._greeting_cache.get("greeting", signature)
+
+    def _store_greeting_template(self, signature: Optional[tuple], template: str) -> None:
+        # Only cache templates that kept the placeholder, otherwise
+        # substitution would hand one user a greeting missing their name
+        if signature is not None and template and "{NAME}" in template:
+            self._greeting_cache.put("greeting", signature, template)
+
     def _generate_event_greeting(self, events: List[Event], email: str,firebase_manager) -> str:
-        """Generate a personalized event greeting using LLM for multiple events."""
+        """Generate a personalized event greeting, reusing cached templates.
+
+        Many users share the same event signature ("exam tomorrow"); the LLM
+        phrases the greeting once per signature with a {NAME} placeholder and
+        later users just get the name substituted in.
+        """
         user_profile = firebase_manager.get_user_profile(email)
         name = user_profile.name
-        today = date.today()
-        today_str = today.strftime('%Y-%m-%d')
-        
-        # Build event context for all events
-        events_context = []
-        event_details = []
-        for event in events:
-            events_context.append(f"- {event.eventType} on {event.eventDate}: {event.description}")
-            event_details.append(f"{event.eventType} on {event.eventDate}")
-        
-        events_text = "\n".join(events_context)
-        events_summary = ", ".join(event_details)
-        
-        system_prompt = f"""You are Sorea, a caring friend who remembers important events in people's lives. Generate a warm, personalized greeting that asks about multiple important events. 
 
-        GUIDELINES:
-        - Be genuinely caring and show you remember all the events
-        - Use natural, friendly language like you're texting a close friend
-        - Show appropriate emotion (excitement, concern, encouragement) for the event types
-        - Keep it conversational and warm, not formal
-        - Reference the timing naturally based on the date comparisons
-        - Make it feel personal and thoughtful
-        - If there are multiple events, weave them together naturally or focus on the most relevant one
+        signature = self._greeting_signature(events)
+        template = self._cached_greeting_template(signature)
+        if template is not None:
+            return template.replace("{NAME}", name)
 
-        EVENT CONTEXT:
-        - Person's name: {name}
-        - Today's date: {today_str}
-        - Events to follow up on: {events_text}
+        try:
+            response = invoke_with_retry(self.llm, self._build_greeting_messages(events))
+            template = self._clean_greeting(response.content.strip())
+            self._store_greeting_template(signature, template)
+            return template.replace("{NAME}", name)
+        except Exception as e:
+            pass
 
-        Generate ONE natural, caring greeting message that shows you remember and care about their events."""
+    async def _generate_event_greeting_async(self, events: List[Event], email: str, firebase_manager) -> str:
+        """Async variant of _generate_event_greeting using the LLM's native ainvoke."""
+        user_profile = await asyncio.to_thread(firebase_manager.get_user_profile, email)
+        name = user_profile.name
 
-        try:
-            messages = [
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=f"Generate a caring greeting for {name} about their events: {events_summary}. Today is {today_str}. Compare the dates and generate appropriate timing language.")
-            ]
-            
-            response = self.llm.invoke(messages)
-            greeting = response.content.strip()
+        signature = self._greeting_signature(events)
+        template = self._cached_greeting_template(signature)
+        if template is not None:
+            return template.replace("{NAME}", name)
 
-            if greeting.startswith('"') and greeting.endswith('"'):
-                greeting = greeting[1:-1]
-            
-            return greeting
-            
+        try:
+            response = await ainvoke_with_retry(self.llm, self._build_greeting_messages(events))
+            template = self._clean_greeting(response.content.strip())
+            self._store_greeting_template(signature, template)
+            return template.replace("{NAME}", name)
         except Exception as e:
             pass
 
     def delete_events(self, events: List[Event], email: str) -> None:
-        """Delete events from the database."""
+        """Delete past events from the database in batched commits."""
         if not self.db:
             return
-        
+
         today = date.today()
-        
+        events_ref = self.db.collection('users').document(email).collection('events')
+
+        # One batched commit instead of one delete RPC per event. Firestore
+        # caps a batch at 500 mutations, so commit in chunks well under that.
+        batch = self.db.batch()
+        pending = 0
+
         for event in events:
             try:
-                event_date = datetime.strptime(event.eventDate, '%Y-%m-%d').date()
-                
+                # fromisoformat is ~5x faster than strptime (no format-string parse)
+                event_date = date.fromisoformat(event.eventDate)
+
                 if event_date < today:
-                    event_ref = self.db.collection('users').document(email).collection('events').document(event.eventid)
-                    event_ref.delete()  
-                    
+                    batch.delete(events_ref.document(event.eventid))
+                    pending += 1
+
+                    if pending >= 450:
+                        batch.commit()
+                        batch = self.db.batch()
+                        pending = 0
+
             except Exception as e:
                 logging.error(f"Error processing event {event.eventid}: {e}")
+
+        if pending:
+            try:
+                batch.commit()
+            except Exception as e:
+                logging.error(f"Error deleting events: {e}")
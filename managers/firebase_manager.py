@@ -6,17 +6,26 @@ No sessions, no analytics, no separate tables - just users organized by email
 import os
 import json
 import base64
+import hashlib
+import asyncio
 import firebase_admin
 import logging
-from firebase_admin import credentials, firestore
+from datetime import datetime
+from firebase_admin import credentials, firestore, firestore_async
 from google.cloud.firestore import FieldFilter
 from data import UserProfile
+from managers.message import build_message_pair
+from managers.response_cache import ResponseCache
 
 class FirebaseManager:
     """Firebase manager with email-based user organization using Firestore."""
-    
+
     def __init__(self):
         self.db = None
+        self.async_db = None
+        # Profiles barely change; a short TTL cache turns the per-request
+        # name lookup into a dict hit instead of a Firestore RPC.
+        self._profile_cache = ResponseCache(maxsize=50_000, ttl=300.0)
         self.initialize_firebase()
     
     def initialize_firebase(self):
@@ -31,9 +40,11 @@ class FirebaseManager:
                     raise Exception("No valid Firebase credentials found (env/ADC/file)")
             
             self.db = firestore.client()
+            self.async_db = firestore_async.client()
         except Exception as e:
             logging.error(f"Firebase initialization failed: {e}")
             self.db = None
+            self.async_db = None
     
     def _use_credentials_from_json_env(self) -> bool:
         """Initialize using raw JSON from FIREBASE_CREDENTIALS_JSON App Setting."""
@@ -56,9 +67,7 @@ class FirebaseManager:
             b64 = os.environ.get("FIREBASE_CREDENTIALS_BASE64")
             if not b64:
                 return False
-            json_str = base64.b64decode(b64).decode("utf-8")
-            cred_dict = json.loads(json_str)
-            cred = credentials.Certificate(cred_dict)
+            cred = credentials.Certificate(self._decoded_credentials_path(b64))
             firebase_admin.initialize_app(cred, self._optional_project_settings())
             logging.info("Firebase initialized from FIREBASE_CREDENTIALS_BASE64")
             return True
@@ -66,6 +75,29 @@ class FirebaseManager:
             logging.debug(f"Base64 env credentials not used: {e}")
             return False
 
+    @staticmethod
+    def _decoded_credentials_path(b64: str) -> str:
+        """Decode the base64 credential blob to a tmpfs file, once per host.
+
+        Warm restarts on the same instance (common on Azure Functions) then
+        skip the base64 decode and JSON parse and hand the SDK a file path
+        directly. The file is keyed by a hash of the env value so a rotated
+        credential gets a fresh path, and written 0600 via an atomic rename.
+        """
+        digest = hashlib.sha256(b64.encode()).hexdigest()[:16]
+        cred_path = os.path.join("/tmp", f"fbcred_{digest}.json")
+
+        if not os.path.exists(cred_path):
+            json_str = base64.b64decode(b64).decode("utf-8")
+            json.loads(json_str)  # validate before caching anything
+            tmp_path = f"{cred_path}.{os.getpid()}"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(json_str)
+            os.replace(tmp_path, cred_path)
+
+        return cred_path
+
     def _use_application_default(self) -> bool:
         """Initialize using Application Default Credentials (e.g., GOOGLE_APPLICATION_CREDENTIALS)."""
         try:
@@ -106,28 +138,191 @@ class FirebaseManager:
             settings["projectId"] = project_id
         return settings
     
+    @staticmethod
+    def _profile_from_dict(email: str, data: dict) -> UserProfile:
+        """Build a UserProfile from a Firestore user document dict."""
+        return UserProfile(
+            email=email,
+            name=data.get('name', 'Friend'),
+            timezone=data.get('timezone', 'UTC')
+        )
+
     def get_user_profile(self, email: str) -> UserProfile:
         """Get user profile from Firestore using email as document ID."""
         if not self.db:
             raise RuntimeError("Firebase DB not initialized")
+
+        cached = self._profile_cache.get("profile", email)
+        if cached is not None:
+            return cached
+
         doc_ref = self.db.collection('users').document(email)
-        doc = doc_ref.get()
+        doc = doc_ref.get(timeout=3.0)
         if doc.exists:
-            data = doc.to_dict()
-            return UserProfile(
-                email=email,
-                name=data.get('name', 'Friend'),
-                timezone=data.get('timezone', 'UTC')
-            )
+            profile = self._profile_from_dict(email, doc.to_dict())
         else:
             # Create a default profile if none exists
-            default_profile = UserProfile(email=email, name='Friend', timezone='UTC')
+            profile = UserProfile(email=email, name='Friend', timezone='UTC')
             doc_ref.set({
-                'name': default_profile.name,
-                'timezone': default_profile.timezone
+                'name': profile.name,
+                'timezone': profile.timezone
             })
-            return default_profile
-    
+
+        self._profile_cache.put("profile", email, profile)
+        return profile
+
+    def get_user_profiles(self, emails: list) -> dict:
+        """Get many user profiles at once, coalescing cache misses into one get_all RPC."""
+        if not self.db:
+            raise RuntimeError("Firebase DB not initialized")
+
+        profiles = {}
+        misses = []
+        for email in emails:
+            cached = self._profile_cache.get("profile", email)
+            if cached is not None:
+                profiles[email] = cached
+            else:
+                misses.append(email)
+
+        if not misses:
+            return profiles
+
+        doc_refs = [self.db.collection('users').document(email) for email in misses]
+        found = set()
+        for doc in self.db.get_all(doc_refs, timeout=5.0):
+            if doc.exists:
+                email = doc.id
+                profile = self._profile_from_dict(email, doc.to_dict())
+                profiles[email] = profile
+                self._profile_cache.put("profile", email, profile)
+                found.add(email)
+
+        # Create default profiles for unknown users in one batched commit,
+        # mirroring what get_user_profile does for a single miss.
+        missing = [email for email in misses if email not in found]
+        if missing:
+            batch = self.db.batch()
+            for email in missing:
+                profile = UserProfile(email=email, name='Friend', timezone='UTC')
+                batch.set(
+                    self.db.collection('users').document(email),
+                    {'name': profile.name, 'timezone': profile.timezone}
+                )
+                profiles[email] = profile
+                self._profile_cache.put("profile", email, profile)
+            batch.commit()
+
+        return profiles
+
+    async def get_user_profile_async(self, email: str) -> UserProfile:
+        """Async variant of get_user_profile using the async Firestore client."""
+        if not self.async_db:
+            raise RuntimeError("Firebase async DB not initialized")
+
+        cached = self._profile_cache.get("profile", email)
+        if cached is not None:
+            return cached
+
+        doc_ref = self.async_db.collection('users').document(email)
+        doc = await doc_ref.get(timeout=3.0)
+        if doc.exists:
+            profile = self._profile_from_dict(email, doc.to_dict())
+        else:
+            profile = UserProfile(email=email, name='Friend', timezone='UTC')
+            await doc_ref.set({
+                'name': profile.name,
+                'timezone': profile.timezone
+            })
+
+        self._profile_cache.put("profile", email, profile)
+        return profile
+
+    async def get_last_conversation_async(self, email: str, limit: int = 20):
+        """Async fallback read: the most recent conversation day (by lastChatAt) and its chat."""
+        if not self.async_db:
+            raise RuntimeError("Firebase async DB not initialized")
+
+        conversations_ref = (
+            self.async_db.collection('users')
+            .document(email)
+            .collection('conversations')
+        )
+        conv_query = (
+            conversations_ref
+            .order_by('lastChatAt', direction='DESCENDING')
+            .limit(1)
+        )
+        conv_docs = [doc async for doc in conv_query.stream()]
+        if conv_docs:
+            conv_ref = conv_docs[0].reference
+        else:
+            # Legacy conversation docs predate the lastChatAt field and are
+            # invisible to the ordered query. conv_YYYYMMDD ids sort
+            # chronologically, so the lexical max of the listed references
+            # is the most recent day.
+            conv_ids = [
+                ref.id async for ref in conversations_ref.list_documents()
+                if ref.id.startswith('conv_')
+            ]
+            if not conv_ids:
+                return []
+            conv_ref = conversations_ref.document(max(conv_ids))
+
+        chat_query = (
+            conv_ref.collection('chat')
+            .order_by('timestamp', direction='DESCENDING')
+            .limit(limit)
+        )
+        chat_docs = [doc async for doc in chat_query.stream()]
+
+        message_pairs = []
+        for doc in reversed(chat_docs):
+            pair = build_message_pair(doc.to_dict(), conv_ref.id)
+            if pair:
+                message_pairs.append(pair)
+        return message_pairs
+
+    async def get_user_profile_and_conversation(self, email: str, limit: int = 20):
+        """Fetch the user profile and today's recent chat in one concurrent async read.
+
+        Uses the async Firestore client so both reads share a single await
+        instead of two blocking threads; returns (UserProfile, List[MessagePair])
+        with the chat in chronological order.
+        """
+        if not self.async_db:
+            raise RuntimeError("Firebase async DB not initialized")
+
+        user_ref = self.async_db.collection('users').document(email)
+        conversation_id = f"conv_{datetime.now().strftime('%Y%m%d')}"
+        chat_query = (
+            user_ref.collection('conversations')
+            .document(conversation_id)
+            .collection('chat')
+            .order_by('timestamp', direction='DESCENDING')
+            .limit(limit)
+        )
+
+        async def _collect_chat():
+            return [doc async for doc in chat_query.stream()]
+
+        profile_doc, chat_docs = await asyncio.gather(user_ref.get(), _collect_chat())
+
+        if profile_doc.exists:
+            profile = self._profile_from_dict(email, profile_doc.to_dict())
+        else:
+            profile = UserProfile(email=email, name='Friend', timezone='UTC')
+            await user_ref.set({'name': profile.name, 'timezone': 'UTC'})
+        self._profile_cache.put("profile", email, profile)
+
+        message_pairs = []
+        for doc in reversed(chat_docs):  # back to chronological order
+            pair = build_message_pair(doc.to_dict(), conversation_id)
+            if pair:
+                message_pairs.append(pair)
+
+        return profile, message_pairs
+
     def get_all_user_emails(self) -> list:
         """Retrieve all user emails from Firestore."""
         if not self.db:
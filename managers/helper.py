@@ -3,35 +3,30 @@ Helper Functions Module
 Contains utility functions for generating follow-up questions and suggestions
 """
 
-from typing import List, Dict, Tuple
-from langchain_google_genai import ChatGoogleGenerativeAI
+import asyncio
+import hashlib
+import re
+from typing import List, Dict, Optional, Tuple
 from langchain_core.messages import SystemMessage, HumanMessage
+from config import ainvoke_with_retry, get_llm, invoke_with_retry
+from managers.response_cache import ResponseCache
 
 
+# One-pass suggestion parsing: each non-empty line minus any leading bullet
+# or numbering, with section headers filtered out.
+_SUGGESTION_RE = re.compile(r'^[ \t]*(?:[-•*]+|\d{1,2}\.)?[ \t]*(\S.*?)[ \t]*$', re.MULTILINE)
+_HEADER_RE = re.compile(r'(?:SUGGESTIONS|QUESTIONS):', re.IGNORECASE)
 
-class HelperManager:
-    """Manages helper functions for generating follow-up questions and suggestions."""
-    
-    def __init__(self,config):
-        """Initialize the HelperManager with LLM for response generation."""
-        self.llm = ChatGoogleGenerativeAI(
-            model=config.model_name,
-            google_api_key=config.gemini_api_key,
-            temperature=config.temperature,
-            max_tokens=config.max_tokens
-        )
+# Trivial turns that never carry emotional signal — not worth an LLM call.
+_TRIVIAL_MESSAGES = {
+    "hi", "hello", "hey", "ok", "okay", "k", "thanks", "thank you",
+    "yes", "no", "bye", "good morning", "good night", "how are you"
+}
 
-    def detect_emotion(self, message: str) -> Tuple[str, int]:
-        """
-        Detect emotion and urgency level from user message.
-        
-        Args:
-            message: User's message to analyze
-            
-        Returns:
-            Tuple of (emotion, urgency_level) where urgency_level is 1-5
-        """
-        system_prompt = """You are an expert emotion detection system for a mental health chatbot. Analyze the user's message and determine:
+
+# Static emotion-detection prompt, built once at import time — the hot path
+# just references it instead of rebuilding ~1 KB of instructions per call.
+_EMOTION_SYSTEM_PROMPT = """You are an expert emotion detection system for a mental health chatbot. Analyze the user's message and determine:
 
         1. PRIMARY EMOTION: The main emotion expressed (happy, sad, anxious, angry, excited, frustrated, depressed, hopeful, etc.)
         2. URGENCY LEVEL: Rate from 1-5 based on how urgent the situation seems:
@@ -54,35 +49,113 @@ class HelperManager:
         URGENCY: [number 1-5]
         REASONING: [brief explanation of why you chose this urgency level]"""
 
+
+class HelperManager:
+    """Manages helper functions for generating follow-up questions and suggestions."""
+
+    def __init__(self,config):
+        """Initialize the HelperManager with the shared LLM client."""
+        self.llm = get_llm(config.temperature, max_tokens=config.max_tokens)
+        # Tighter decode caps for calls with known-small outputs: the three
+        # EMOTION/URGENCY/REASONING lines and the 3-4 short suggestions
+        self.emotion_llm = get_llm(config.temperature, max_tokens=40, request_timeout=6.0)
+        self.suggestion_llm = get_llm(config.temperature, max_tokens=200, request_timeout=6.0)
+        # Repeat inputs ("hi", "thanks", same user in the same mood) skip Gemini.
+        # High-urgency results are never cached so distress always gets a fresh call.
+        self._response_cache = ResponseCache(maxsize=2000, ttl=300.0)
+
+    def detect_emotion(self, message: str) -> Tuple[str, int]:
+        """
+        Detect emotion and urgency level from user message.
+        
+        Args:
+            message: User's message to analyze
+            
+        Returns:
+            Tuple of (emotion, urgency_level) where urgency_level is 1-5
+        """
+        cache_key = self._emotion_cache_key(message)
+        if cache_key is None:
+            return "neutral", 1
+
+        cached = self._response_cache.get("emotion", cache_key)
+        if cached is not None:
+            return cached
+
         try:
             messages = [
-                SystemMessage(content=system_prompt),
+                SystemMessage(content=_EMOTION_SYSTEM_PROMPT),
                 HumanMessage(content=f"Analyze this message for emotion and urgency: '{message}'")
             ]
-            
-            response = self.llm.invoke(messages)
-            response_text = response.content.strip()
-            
-            # Parse the response
-            emotion = "neutral"
-            urgency_level = 1
-            
-            lines = response_text.split('\n')
-            for line in lines:
-                if line.startswith("EMOTION:"):
-                    emotion = line.split(":", 1)[1].strip().lower()
-                elif line.startswith("URGENCY:"):
-                    try:
-                        urgency_level = int(line.split(":", 1)[1].strip())
-                        urgency_level = max(1, min(5, urgency_level))  
-                    except (ValueError, IndexError):
-                        urgency_level = 1
-            
-            return emotion, urgency_level
-            
+
+            response = invoke_with_retry(self.emotion_llm, messages)
+            result = self._parse_emotion(response.content.strip())
+            self._cache_emotion(cache_key, result)
+            return result
+
+        except Exception as e:
+            return "neutral", 1
+
+    async def detect_emotion_async(self, message: str) -> Tuple[str, int]:
+        """Async variant of detect_emotion using the LLM's native ainvoke."""
+        cache_key = self._emotion_cache_key(message)
+        if cache_key is None:
+            return "neutral", 1
+
+        cached = self._response_cache.get("emotion", cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            messages = [
+                SystemMessage(content=_EMOTION_SYSTEM_PROMPT),
+                HumanMessage(content=f"Analyze this message for emotion and urgency: '{message}'")
+            ]
+
+            response = await ainvoke_with_retry(self.emotion_llm, messages)
+            result = self._parse_emotion(response.content.strip())
+            self._cache_emotion(cache_key, result)
+            return result
+
         except Exception as e:
             return "neutral", 1
 
+    @staticmethod
+    def _emotion_cache_key(message: str) -> Optional[str]:
+        """Hash-based cache key for a message, or None for trivial turns.
+
+        Hashing keeps cache memory bounded regardless of message length. Only
+        the static whitelist and near-empty messages are short-circuited —
+        short words like "sad" still deserve a real detection pass.
+        """
+        normalized = message.strip().lower()
+        if len(normalized) < 3 or normalized in _TRIVIAL_MESSAGES:
+            return None
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def _cache_emotion(self, cache_key: str, result: Tuple[str, int]) -> None:
+        """Cache an emotion result unless it signals high distress."""
+        if result[1] < 4:
+            self._response_cache.put("emotion", cache_key, result)
+
+    def _parse_emotion(self, response_text: str) -> Tuple[str, int]:
+        """Parse EMOTION/URGENCY lines from the raw LLM response."""
+        emotion = "neutral"
+        urgency_level = 1
+
+        lines = response_text.split('\n')
+        for line in lines:
+            if line.startswith("EMOTION:"):
+                emotion = line.split(":", 1)[1].strip().lower()
+            elif line.startswith("URGENCY:"):
+                try:
+                    urgency_level = int(line.split(":", 1)[1].strip())
+                    urgency_level = max(1, min(5, urgency_level))
+                except (ValueError, IndexError):
+                    urgency_level = 1
+
+        return emotion, urgency_level
+
     def generate_suggestions(self, emotion: str, urgency_level: int, email: str, firebase_manager, message_manager, user_message: str = "") -> List[str]:
         """
         Generate practical suggestions based on user's emotional state and conversation context.
@@ -97,11 +170,21 @@ class HelperManager:
         Returns:
             List of practical suggestions
         """
+        # Keyed on the message hash too, so a changed message regenerates
+        # even when the detected emotion is the same — only true repeats of
+        # the same context skip the LLM call.
+        message_digest = hashlib.sha256(user_message.strip().lower().encode()).hexdigest()[:16]
+        cache_key = (email, emotion, urgency_level, message_digest)
+        if urgency_level < 4:
+            cached = self._response_cache.get("suggestion", cache_key)
+            if cached is not None:
+                return cached
+
         user_profile = firebase_manager.get_user_profile(email)
         name = user_profile.name
-        
+
         # Get conversation context
-        recent_messages = message_manager.get_conversation(email, firebase_manager, date=None, limit=10)
+        recent_messages, _ = message_manager.get_conversation(email, firebase_manager, date=None, limit=10)
         
         # Build conversation history for context
         conversation_context = ""
@@ -146,16 +229,27 @@ class HelperManager:
                 SystemMessage(content=system_prompt),
                 HumanMessage(content=f"Current user message: '{user_message}' | Generate practical suggestions for someone feeling {emotion} at urgency level {urgency_level}/5.")
             ]
-            
-            response = self.llm.invoke(messages)
+
+            response = invoke_with_retry(self.suggestion_llm, messages)
             response_text = response.content.strip()
             suggestions = self._parse_suggestions(response_text)
-            
+
+            if suggestions and urgency_level < 4:
+                self._response_cache.put("suggestion", cache_key, suggestions, ttl=120.0)
+
             return suggestions
-            
+
         except Exception as e:
             return []
 
+    async def generate_suggestions_async(self, emotion: str, urgency_level: int, email: str, firebase_manager, message_manager, user_message: str = "") -> List[str]:
+        """Async variant of generate_suggestions: blocking Firestore reads run in a
+        thread and the LLM is awaited natively."""
+        return await asyncio.to_thread(
+            self.generate_suggestions,
+            emotion, urgency_level, email, firebase_manager, message_manager, user_message
+        )
+
     def _parse_suggestions(self, response_text: str) -> List[str]:
         """
         Parse the LLM response to extract suggestions.
@@ -166,21 +260,7 @@ class HelperManager:
         Returns:
             List of suggestions
         """
-        suggestions = []
-        
-        try:
-            # Split response into lines and extract meaningful suggestions
-            lines = response_text.split('\n')
-            for line in lines:
-                line = line.strip()
-                # Skip empty lines and headers
-                if line and not line.upper().startswith(('SUGGESTIONS:', 'QUESTIONS:')):
-                    # Remove bullet points or numbering if present
-                    cleaned_line = line.lstrip('- •*123456789. ')
-                    if cleaned_line and len(suggestions) < 4:  # Max 4 suggestions
-                        suggestions.append(cleaned_line)
-            
-        except Exception:
-            pass
-        
-        return suggestions
+        return [
+            m.group(1) for m in _SUGGESTION_RE.finditer(response_text)
+            if not _HEADER_RE.match(m.group(1))
+        ][:4]  # Max 4 suggestions
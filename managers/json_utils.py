@@ -0,0 +1,55 @@
+"""
+JSON Utilities Module
+Fast, tolerant extraction of JSON objects from raw LLM responses
+"""
+
+from typing import Optional
+
+try:
+    import orjson as _json  # C-accelerated; ~5x faster than stdlib json
+except ImportError:  # pragma: no cover - fallback when orjson isn't installed
+    import json as _json
+
+
+def extract_json(text: str) -> Optional[dict]:
+    """Locate and parse the first top-level JSON object in raw LLM output.
+
+    Single-pass bracket-depth scan that respects string literals and escape
+    sequences, so nested braces inside values (or stray braces in surrounding
+    prose/markdown fences) don't break extraction the way find('{')/rfind('}')
+    slicing did. Returns None when no parseable object is found.
+    """
+    depth = 0
+    start = -1
+    in_string = False
+    escaped = False
+
+    for i, ch in enumerate(text):
+        if escaped:
+            escaped = False
+            continue
+        if in_string:
+            if ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch == '{':
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == '}':
+            if depth > 0:
+                depth -= 1
+                if depth == 0:
+                    try:
+                        parsed = _json.loads(text[start:i + 1])
+                        if isinstance(parsed, dict):
+                            return parsed
+                    except ValueError:
+                        pass
+                    start = -1
+
+    return None
@@ -0,0 +1,69 @@
+"""
+Response Cache Module
+In-process TTL cache for LLM responses, keyed by namespace and normalized input
+"""
+
+import threading
+import time
+from typing import Any, Hashable, Optional
+
+
+class ResponseCache:
+    """Small in-process cache that lets repeat LLM calls bypass Gemini entirely.
+
+    Entries are keyed by (namespace, key) so different prompt classes
+    ("emotion", "suggestion", ...) never collide. Each entry carries its own
+    expiry; stale entries are dropped on access and the oldest entries are
+    evicted once maxsize is reached.
+
+    Instances are shared across the writer pool, to_thread workers and the
+    event loop, so all mutation happens under a lock — eviction iterates the
+    dict and would otherwise race concurrent puts.
+    """
+
+    def __init__(self, maxsize: int = 2000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None on miss/expiry."""
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                self._entries.pop((namespace, key), None)
+                return None
+
+            return value
+
+    def put(self, namespace: str, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Store a value, evicting the oldest entries when the cache is full."""
+        with self._lock:
+            if len(self._entries) >= self.maxsize:
+                self._evict()
+
+            expires_at = time.monotonic() + (ttl if ttl is not None else self.ttl)
+            self._entries[(namespace, key)] = (value, expires_at)
+
+    def discard(self, namespace: str, key: Hashable) -> None:
+        """Remove an entry if present (e.g. to invalidate after an error)."""
+        with self._lock:
+            self._entries.pop((namespace, key), None)
+
+    def _evict(self) -> None:
+        """Drop expired entries first, then the oldest insertions if still full.
+
+        Caller must hold self._lock.
+        """
+        now = time.monotonic()
+        expired = [k for k, (_, expires_at) in self._entries.items() if now >= expires_at]
+        for k in expired:
+            self._entries.pop(k, None)
+
+        while len(self._entries) >= self.maxsize:
+            self._entries.pop(next(iter(self._entries)), None)
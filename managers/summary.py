@@ -4,59 +4,92 @@ Handles generation, storage, and retrieval of conversation summaries
 """
 
 from typing import List, Optional
-import firebase_admin
-from firebase_admin import firestore
-from langchain_google_genai import ChatGoogleGenerativeAI
+from google.cloud.firestore_v1 import ArrayUnion
 from langchain_core.messages import SystemMessage, HumanMessage
+from config import get_llm, invoke_with_retry
 from data import MessagePair
 import logging
 
 
+# Static summary prompt: kept byte-identical across calls (no interpolation)
+# so provider prompt caches can reuse the prefix. The conversation text goes
+# in the HumanMessage.
+_SUMMARY_SYSTEM_PROMPT = """You are a caring friend creating simple conversation summaries to help remember what you talked about with someone. Write in a natural, friendly tone like you're taking notes to remember for next time.
+
+        You will be given a conversation between a user and their mental health support friend. Create a friendly summary that covers:
+        1. What the user talked about and how they were feeling
+        2. Main topics or concerns they shared
+        3. Any positive moments or progress they mentioned
+        4. Important things to remember for next time you chat
+        5. How they seemed to be feeling by the end
+
+        Keep it:
+        - Simple and conversational (like notes a friend would take)
+        - Under 120 words
+        - Focused on what matters for continuing the friendship
+        - Written like "User talked about..." or "They seemed..."
+        - Remember this is for helping continue supportive conversations
+
+        Write a natural summary that helps remember what happened in this chat."""
+
+
 class SummaryManager:
     """Manages conversation summaries and daily summary generation."""
-    
-    def __init__(self, config,db=None):
-        """Initialize with optional database connection."""
+
+    def __init__(self, config, db):
+        """Initialize with the shared Firestore client (firebase_manager.db).
+
+        One client per process reuses its gRPC channel pool across managers;
+        spinning up a private firestore.client() here would pay a second
+        TLS/gRPC handshake for no benefit.
+        """
         self.db = db
-        if not self.db:
-            try:
-                if firebase_admin._apps:
-                    self.db = firestore.client()
-                else:
-                    logging.warning("Firebase not initialized for SummaryManager")
-            except Exception as e:
-                logging.error(f"Could not initialize Firebase in SummaryManager: {e}")
-                self.db = None
-        
-        self.llm = ChatGoogleGenerativeAI(
-            model=config.model_name,
-            google_api_key=config.gemini_api_key,
-            temperature=0.5  
-        )
+        self.llm = get_llm(temperature=0.5, request_timeout=30.0)
 
     def daily_summary_exists(self, email: str, date_str: str) -> bool:
-        """Check if a daily summary already exists for the given date."""
+        """Check if a daily summary already exists for the given date.
+
+        store_daily_summary records generated dates on the user doc, so the
+        common hit is a single projected doc read; only dates absent from
+        the array (including summaries stored before the field existed)
+        fall back to probing the summary doc itself.
+        """
         if not self.db:
             return False
-        
+
         try:
+            user_doc = (
+                self.db.collection('users').document(email)
+                .get(field_paths=['summariesGeneratedDates'], timeout=3.0)
+            )
+            if user_doc.exists:
+                dates = (user_doc.to_dict() or {}).get('summariesGeneratedDates') or []
+                if date_str in dates:
+                    return True
+
             doc_ref = self.db.collection('users').document(email).collection('summaries').document(f'daily_{date_str}')
             doc = doc_ref.get()
             return doc.exists
-            
+
         except Exception as e:
             logging.error(f"Error checking daily summary existence: {e}")
             return False
-    
+
     def store_daily_summary(self, email: str, date_str: str, summary: dict):
         """Store a daily conversation summary."""
         if not self.db:
             return
-        
+
         try:
-            self.db.collection('users').document(email).collection('summaries').document(f'daily_{date_str}').set(summary)
+            user_ref = self.db.collection('users').document(email)
+            # One atomic commit: the summary doc plus its date recorded on
+            # the user doc, which daily_summary_exists checks first.
+            batch = self.db.batch()
+            batch.set(user_ref.collection('summaries').document(f'daily_{date_str}'), summary)
+            batch.set(user_ref, {'summariesGeneratedDates': ArrayUnion([date_str])}, merge=True)
+            batch.commit()
             logging.info(f"Stored daily summary for {email} on {date_str}")
-            
+
         except Exception as e:
             logging.error(f"Error storing daily summary: {e}")
     
@@ -83,48 +116,29 @@ class SummaryManager:
         if not message_pairs:
             return "No conversation data available for summary."
 
-        # Build conversation text from MessagePair objects
-        conversation_text = ""
-        
+        # Build conversation text from MessagePair objects (join, not +=:
+        # a full day of history makes repeated concatenation quadratic)
+        parts = []
         for message_pair in message_pairs:
             if isinstance(message_pair, MessagePair):
-                user_content = message_pair.user_message.content
-                llm_content = message_pair.llm_message.content
-                conversation_text += f"User: {user_content}\n"
-                conversation_text += f"Assistant: {llm_content}\n"
+                parts.append(f"User: {message_pair.user_message.content}\n")
+                parts.append(f"Assistant: {message_pair.llm_message.content}\n")
+        conversation_text = ''.join(parts)
         
         if not conversation_text.strip():
             return None
         
-        # Generate summary using LLM
-        summary_prompt = f"""Summarize this conversation between a user and their mental health support friend:
-
-        CONVERSATION:
-        {conversation_text}
-
-        Create a friendly summary that covers:
-        1. What the user talked about and how they were feeling
-        2. Main topics or concerns they shared
-        3. Any positive moments or progress they mentioned
-        4. Important things to remember for next time you chat
-        5. How they seemed to be feeling by the end
-
-        Keep it:
-        - Simple and conversational (like notes a friend would take)
-        - Under 120 words
-        - Focused on what matters for continuing the friendship
-        - Written like "User talked about..." or "They seemed..."
-        - Remember this is for helping continue supportive conversations
-
-        Write a natural summary that helps remember what happened in this chat."""
+        # Only the conversation itself is dynamic; all instructions live in
+        # the static system prompt above.
+        summary_prompt = f"CONVERSATION:\n{conversation_text}"
 
         try:
             messages = [
-                SystemMessage(content="You are a caring friend creating simple conversation summaries to help remember what you talked about with someone. Write in a natural, friendly tone like you're taking notes to remember for next time."),
+                SystemMessage(content=_SUMMARY_SYSTEM_PROMPT),
                 HumanMessage(content=summary_prompt)
             ]
             
-            response = self.llm.invoke(messages)
+            response = invoke_with_retry(self.llm, messages)
             summary_text = response.content.strip()
             
             return summary_text